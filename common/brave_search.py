@@ -0,0 +1,309 @@
+"""
+    Brave Search API client shared by the agents.
+
+    Unlike the langchain `BraveSearch` tool, which returns the results as the string
+    of a Python list, results are returned as typed `SearchResult` objects validated
+    straight from the JSON response, and the async client does not block the event loop.
+
+    Every search goes through:
+        - a TTL cache keyed by the normalized query (BRAVE_SEARCH_CACHE_TTL seconds)
+        - a token-bucket rate limiter matching the API quota (BRAVE_SEARCH_RATE
+          requests per second, bursts of BRAVE_SEARCH_BURST)
+        - retries with exponential backoff on 429 / 5xx / network errors, at most
+          BRAVE_SEARCH_MAX_RETRIES attempts
+    Hits, misses, requests, retries and errors are counted in `metrics`.
+"""
+import os
+import re
+import time
+import asyncio
+import threading
+from collections import Counter
+from functools import lru_cache
+from typing import Optional
+
+import httpx
+from pydantic import BaseModel, ConfigDict, Field
+from loguru import logger as log
+from tenacity import (
+    AsyncRetrying, Retrying, RetryCallState, retry_if_exception, stop_after_attempt, wait_exponential_jitter,
+)
+
+from common.cache import TTLCache, normalize_query
+from common.instrumentation import record_cache_hit
+
+
+BRAVE_SEARCH_URL = 'https://api.search.brave.com/res/v1/web/search'
+BRAVE_SEARCH_TIMEOUT = float(os.environ.get('BRAVE_SEARCH_TIMEOUT', 10))
+BRAVE_SEARCH_RATE = float(os.environ.get('BRAVE_SEARCH_RATE', 1))
+BRAVE_SEARCH_BURST = int(os.environ.get('BRAVE_SEARCH_BURST', 1))
+BRAVE_SEARCH_MAX_RETRIES = int(os.environ.get('BRAVE_SEARCH_MAX_RETRIES', 4))
+BRAVE_SEARCH_CACHE_TTL = float(os.environ.get('BRAVE_SEARCH_CACHE_TTL', 3600))
+BRAVE_SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get('BRAVE_SEARCH_CACHE_MAX_ENTRIES', 2048))
+
+HTML_TAGS = re.compile(r'<[^>]+>')
+
+
+class SearchResult(BaseModel):
+    """Web search result"""
+    model_config = ConfigDict(frozen=True)
+
+    title: str
+    link: str
+    snippet: str
+
+
+class _BraveWebResult(BaseModel):
+    title: Optional[str] = None
+    url: Optional[str] = None
+    description: Optional[str] = None
+    extra_snippets: Optional[list[str]] = None
+
+
+class _BraveWebResults(BaseModel):
+    results: list[_BraveWebResult] = Field(default_factory=list)
+
+
+class _BraveResponse(BaseModel):
+    web: _BraveWebResults = Field(default_factory=_BraveWebResults)
+
+
+def parse_results(content: bytes | str) -> list[SearchResult]:
+    """
+        Parses the body of a Brave web search response into SearchResult objects.
+        The JSON is validated in a single pass by pydantic, only the fields used are kept.
+    """
+    return [
+        SearchResult(
+            title=HTML_TAGS.sub('', result.title or ''),
+            link=result.url or '',
+            snippet=HTML_TAGS.sub('', ' '.join(filter(None, [result.description, *(result.extra_snippets or [])]))),
+        )
+        for result in _BraveResponse.model_validate_json(content).web.results
+    ]
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+
+    return isinstance(error, httpx.TransportError)
+
+
+class TokenBucket:
+    """
+        Token-bucket rate limiter: `rate` tokens are added per second, up to `capacity`.
+        It is shared by threads and event loops, only the waiting is sync or async.
+    """
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+
+    def _reserve(self) -> float:
+        """
+            Takes a token, possibly ahead of time, and returns the seconds to wait for it
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1
+
+            return max(0.0, -self._tokens / self.rate)
+
+
+    def acquire(self) -> None:
+        delay = self._reserve()
+        if delay:
+            time.sleep(delay)
+
+
+    async def aacquire(self) -> None:
+        delay = self._reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class BraveSearchClient:
+    """
+        Brave web search over a pooled HTTP connection. The async client is bound to
+        the event loop that created it, so it is re-created when the running loop changes.
+        Concurrent async searches of the same query share a single request.
+    """
+    def __init__(
+            self,
+            api_key: Optional[str] = None,
+            count: int = 3,
+            timeout: float = BRAVE_SEARCH_TIMEOUT,
+            rate: float = BRAVE_SEARCH_RATE,
+            burst: int = BRAVE_SEARCH_BURST,
+            max_retries: int = BRAVE_SEARCH_MAX_RETRIES,
+            cache_ttl: float = BRAVE_SEARCH_CACHE_TTL,
+            cache_max_entries: int = BRAVE_SEARCH_CACHE_MAX_ENTRIES,
+        ):
+        self.api_key = api_key or os.environ.get('BRAVE_SEARCH_API_KEY')
+        self.count = count
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.rate_limiter = TokenBucket(rate, burst)
+        self.cache = TTLCache(ttl=cache_ttl, max_entries=cache_max_entries)
+        self.metrics = Counter()
+        self._client: Optional[httpx.Client] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._in_flight: dict[tuple[str, int], asyncio.Task] = {}
+
+
+    @property
+    def headers(self) -> dict:
+        return {
+            'Accept': 'application/json',
+            'X-Subscription-Token': self.api_key or '',
+        }
+
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._loop is not loop:
+            self._async_client = httpx.AsyncClient(headers=self.headers, timeout=self.timeout)
+            self._in_flight = {}
+            self._loop = loop
+
+        return self._async_client
+
+
+    @staticmethod
+    def _params(query: str, count: int) -> dict:
+        # extra snippets add context to the description, as requested by the langchain BraveSearch tool
+        return {'q': query, 'count': count, 'extra_snippets': True}
+
+
+    def _retry_kwargs(self) -> dict:
+        return {
+            'stop': stop_after_attempt(self.max_retries),
+            'wait': wait_exponential_jitter(initial=1, max=30),
+            'retry': retry_if_exception(is_retryable),
+            'before_sleep': self._on_retry,
+            'reraise': True,
+        }
+
+
+    def _on_retry(self, retry_state: RetryCallState) -> None:
+        self.metrics['retries'] += 1
+        error = retry_state.outcome.exception()
+        if isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 429:
+            self.metrics['rate_limited'] += 1
+        log.warning(f'Brave search attempt {retry_state.attempt_number} failed, retrying: {error}')
+
+
+    def _cached(self, key: tuple[str, int]) -> Optional[list[SearchResult]]:
+        results = self.cache.get(key)
+        self.metrics['hits' if results is not None else 'misses'] += 1
+        if results is not None:
+            record_cache_hit('web_search')
+
+        return results
+
+
+    def search(self, query: str, count: Optional[int] = None) -> list[SearchResult]:
+        key = (normalize_query(query), count or self.count)
+        if (results := self._cached(key)) is not None:
+            return results
+
+        if self._client is None:
+            self._client = httpx.Client(headers=self.headers, timeout=self.timeout)
+
+        try:
+            for attempt in Retrying(**self._retry_kwargs()):
+                with attempt:
+                    self.rate_limiter.acquire()
+                    self.metrics['requests'] += 1
+                    response = self._client.get(BRAVE_SEARCH_URL, params=self._params(query, key[1]))
+                    response.raise_for_status()
+        except Exception:
+            self.metrics['errors'] += 1
+            raise
+
+        results = parse_results(response.content)
+        self.cache.set(key, results)
+
+        return results
+
+
+    async def asearch(self, query: str, count: Optional[int] = None) -> list[SearchResult]:
+        key = (normalize_query(query), count or self.count)
+        if (results := self._cached(key)) is not None:
+            return results
+
+        client = self._get_async_client()
+        task = self._in_flight.get(key)
+        if task is None:
+            # detached from the caller: cancelling one waiter (e.g. a discarded speculative
+            # search) does not cancel the request the other waiters share
+            task = asyncio.get_running_loop().create_task(self._afetch(client, query, key))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._on_fetched(key, done))
+        else:
+            self.metrics['coalesced'] += 1
+
+        return await asyncio.shield(task)
+
+
+    async def _afetch(self, client: httpx.AsyncClient, query: str, key: tuple[str, int]) -> list[SearchResult]:
+        try:
+            async for attempt in AsyncRetrying(**self._retry_kwargs()):
+                with attempt:
+                    await self.rate_limiter.aacquire()
+                    self.metrics['requests'] += 1
+                    response = await client.get(BRAVE_SEARCH_URL, params=self._params(query, key[1]))
+                    response.raise_for_status()
+        except Exception:
+            self.metrics['errors'] += 1
+            raise
+
+        results = parse_results(response.content)
+        self.cache.set(key, results)
+
+        return results
+
+
+    def _on_fetched(self, key: tuple[str, int], task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # the error is raised to the waiters, if every waiter was cancelled it is only logged
+        if not task.cancelled() and task.exception() is not None:
+            log.warning(f'Brave search failed: {task.exception()}')
+
+
+    def stats(self) -> dict:
+        """
+            Search metrics, including the cache hit rate
+        """
+        lookups = self.metrics['hits'] + self.metrics['misses']
+
+        return {
+            **self.metrics,
+            'hit_rate': self.metrics['hits'] / lookups if lookups else 0.0,
+            'cache_size': len(self.cache),
+        }
+
+
+    async def aclose(self) -> None:
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+
+@lru_cache(maxsize=None)
+def get_search_client(api_key: Optional[str] = None) -> BraveSearchClient:
+    """
+        Process-wide search client, so every agent shares the cache and the rate limit
+    """
+    return BraveSearchClient(api_key=api_key)
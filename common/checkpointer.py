@@ -0,0 +1,428 @@
+"""
+    Persistent and compact LangGraph checkpointers shared by the agents.
+
+    CHECKPOINT_BACKEND selects where conversation state is stored:
+        - 'memory': in process memory (lost on restart)
+        - 'sqlite': local SQLite file, CHECKPOINT_DB_URI is the database path
+        - 'postgres': CHECKPOINT_DB_URI is the Postgres connection string
+
+    Only the last CHECKPOINT_KEEP_LAST checkpoints of a thread are kept, threads inactive
+    for more than CHECKPOINT_TTL seconds are deleted, and stored blobs are zlib-compressed.
+"""
+import os
+import time
+import asyncio
+import zlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+from loguru import logger as log
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.serde.base import SerializerProtocol
+
+from common.serde import MessageSerializer
+
+
+EVICTION_INTERVAL = 300     # seconds between two sweeps of expired threads
+
+ACTIVITY_DDL = (
+    'CREATE TABLE IF NOT EXISTS thread_activity '
+    '(thread_id TEXT PRIMARY KEY, last_seen DOUBLE PRECISION NOT NULL)'
+)
+
+
+def _retention_sql(backend: str) -> dict[str, str]:
+    p = '?' if backend == 'sqlite' else '%s'
+    writes_table = 'writes' if backend == 'sqlite' else 'checkpoint_writes'
+
+    sql = {
+        'touch': (
+            f'INSERT INTO thread_activity (thread_id, last_seen) VALUES ({p}, {p}) '
+            'ON CONFLICT (thread_id) DO UPDATE SET last_seen = excluded.last_seen'
+        ),
+        'expired': f'SELECT thread_id FROM thread_activity WHERE last_seen < {p}',
+        'forget': f'DELETE FROM thread_activity WHERE thread_id = {p}',
+        'prune_checkpoints': (
+            f'DELETE FROM checkpoints WHERE thread_id = {p} AND checkpoint_id NOT IN '
+            f'(SELECT checkpoint_id FROM checkpoints WHERE thread_id = {p} ORDER BY checkpoint_id DESC LIMIT {p})'
+        ),
+        'prune_writes': (
+            f'DELETE FROM {writes_table} WHERE thread_id = {p} AND checkpoint_id NOT IN '
+            f'(SELECT checkpoint_id FROM checkpoints WHERE thread_id = {p})'
+        ),
+    }
+    if backend == 'postgres':
+        # channel values are stored once per version and referenced by the checkpoints
+        sql['prune_blobs'] = (
+            'DELETE FROM checkpoint_blobs b WHERE b.thread_id = %s AND NOT EXISTS ('
+            'SELECT 1 FROM checkpoints c WHERE c.thread_id = b.thread_id AND c.checkpoint_ns = b.checkpoint_ns '
+            "AND c.checkpoint -> 'channel_versions' ->> b.channel = b.version)"
+        )
+
+    return sql
+
+
+class CompressedSerializer(SerializerProtocol):
+    """
+        Wraps a serializer and zlib-compresses payloads of at least `min_size` bytes.
+        Compressed payloads are tagged with a '+zlib' type suffix, so uncompressed
+        checkpoints written before remain readable.
+    """
+    def __init__(self, serde: Optional[SerializerProtocol] = None, level: int = 6, min_size: int = 1024):
+        self.serde = serde or MessageSerializer()
+        self.level = level
+        self.min_size = min_size
+
+
+    def dumps(self, obj: Any) -> bytes:
+        return self.serde.dumps(obj)
+
+
+    def loads(self, data: bytes) -> Any:
+        return self.serde.loads(data)
+
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        type_, data = self.serde.dumps_typed(obj)
+        if len(data) < self.min_size:
+            return type_, data
+
+        return f'{type_}+zlib', zlib.compress(data, self.level)
+
+
+    def loads_typed(self, data: tuple[str, bytes]) -> Any:
+        type_, payload = data
+        if type_.endswith('+zlib'):
+            return self.serde.loads_typed((type_.removesuffix('+zlib'), zlib.decompress(payload)))
+
+        return self.serde.loads_typed(data)
+
+
+def _prune_memory_thread(saver: InMemorySaver, thread_id: str, keep_last: int) -> None:
+    """
+        Keeps the last `keep_last` checkpoints of a thread held by an InMemorySaver,
+        with their pending writes and the channel blobs they reference
+    """
+    referenced = set()
+    for checkpoint_ns, checkpoints in saver.storage.get(thread_id, {}).items():
+        checkpoint_ids = sorted(checkpoints)
+        for checkpoint_id in checkpoint_ids[:-keep_last]:
+            del checkpoints[checkpoint_id]
+            saver.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+        for checkpoint_id in checkpoint_ids[-keep_last:]:
+            checkpoint = saver.serde.loads_typed(checkpoints[checkpoint_id][0])
+            referenced.update(
+                (checkpoint_ns, channel, version) for channel, version in checkpoint['channel_versions'].items()
+            )
+
+    stale_blobs = [key for key in saver.blobs if key[0] == thread_id and key[1:] not in referenced]
+    for key in stale_blobs:
+        del saver.blobs[key]
+
+
+class _RetentionPolicy:
+    def __init__(
+            self,
+            backend: Optional[str] = None,
+            db_uri: Optional[str] = None,
+            default_sqlite_path: str = 'checkpoints.sqlite',
+            ttl: Optional[float] = None,
+            keep_last: Optional[int] = None,
+            serde: Optional[SerializerProtocol] = None,
+        ):
+        self.backend = backend or os.environ.get('CHECKPOINT_BACKEND', 'sqlite')
+        if self.backend not in ('memory', 'sqlite', 'postgres'):
+            raise ValueError(f'Unknown checkpoint backend: {self.backend}')
+
+        self.db_uri = db_uri or os.environ.get('CHECKPOINT_DB_URI', default_sqlite_path)
+        self.ttl = ttl if ttl is not None else float(os.environ.get('CHECKPOINT_TTL', 7 * 24 * 3600))
+        self.keep_last = keep_last if keep_last is not None else int(os.environ.get('CHECKPOINT_KEEP_LAST', 10))
+        self.pool_size = int(os.environ.get('CHECKPOINT_POOL_SIZE', 10))
+        self.serde = serde or CompressedSerializer()
+        self.sql = _retention_sql(self.backend)
+        self.saver: Optional[BaseCheckpointSaver] = None
+        self._last_seen: dict[str, float] = {}      # thread activity of the memory backend
+        self._last_eviction = time.monotonic()
+
+
+    def _eviction_due(self) -> bool:
+        if time.monotonic() - self._last_eviction < EVICTION_INTERVAL:
+            return False
+
+        self._last_eviction = time.monotonic()
+        return True
+
+
+class CheckpointManager(_RetentionPolicy):
+    """
+        Creates the configured checkpointer for a synchronous graph and applies the
+        retention policy after every conversation turn
+    """
+    def setup(self) -> BaseCheckpointSaver:
+        if self.saver is not None:
+            return self.saver
+
+        if self.backend == 'memory':
+            self.saver = InMemorySaver(serde=self.serde)
+
+        elif self.backend == 'sqlite':
+            from langgraph.checkpoint.sqlite import SqliteSaver
+
+            Path(self.db_uri).parent.mkdir(parents=True, exist_ok=True)
+            self.saver = SqliteSaver(sqlite3.connect(self.db_uri, check_same_thread=False), serde=self.serde)
+            self.saver.setup()
+            with self.saver.cursor() as cur:
+                cur.execute(ACTIVITY_DDL)
+
+        else:
+            from psycopg.rows import dict_row
+            from psycopg_pool import ConnectionPool
+            from langgraph.checkpoint.postgres import PostgresSaver
+
+            pool = ConnectionPool(
+                conninfo=self.db_uri,
+                max_size=self.pool_size,
+                kwargs={'autocommit': True, 'prepare_threshold': 0, 'row_factory': dict_row},
+            )
+            self.saver = PostgresSaver(pool, serde=self.serde)
+            self.saver.setup()
+            with pool.connection() as conn:
+                conn.execute(ACTIVITY_DDL)
+
+        log.info(f'Using {self.backend} checkpointer')
+
+        return self.saver
+
+
+    def close(self) -> None:
+        """
+            Closes the database connection (or pool) of the checkpointer
+        """
+        if self.saver is not None and self.backend != 'memory':
+            self.saver.conn.close()
+        self.saver = None
+
+
+    def _execute(self, statements: list[tuple[str, tuple]]) -> list:
+        rows = []
+        if self.backend == 'sqlite':
+            with self.saver.cursor() as cur:
+                for query, params in statements:
+                    rows.extend(row[0] for row in cur.execute(query, params).fetchall())
+        else:
+            with self.saver.conn.connection() as conn:
+                for query, params in statements:
+                    cursor = conn.execute(query, params)
+                    if cursor.description:
+                        rows.extend(row['thread_id'] for row in cursor.fetchall())
+
+        return rows
+
+
+    def after_turn(self, thread_id: str) -> None:
+        """
+            Records thread activity, prunes old checkpoints of the thread and
+            periodically deletes expired threads
+        """
+        thread_id = str(thread_id)
+        if self.backend == 'memory':
+            self._last_seen[thread_id] = time.time()
+            _prune_memory_thread(self.saver, thread_id, self.keep_last)
+
+        else:
+            statements = [
+                (self.sql['touch'], (thread_id, time.time())),
+                (self.sql['prune_checkpoints'], (thread_id, thread_id, self.keep_last)),
+                (self.sql['prune_writes'], (thread_id, thread_id)),
+            ]
+            if 'prune_blobs' in self.sql:
+                statements.append((self.sql['prune_blobs'], (thread_id,)))
+            self._execute(statements)
+
+        if self._eviction_due():
+            self.evict_expired()
+
+
+    def evict_expired(self) -> int:
+        """
+            Deletes every thread inactive for longer than the TTL
+
+            Returns:
+                int: Number of deleted threads
+        """
+        cutoff = time.time() - self.ttl
+        if self.backend == 'memory':
+            expired = [thread_id for thread_id, last_seen in self._last_seen.items() if last_seen < cutoff]
+        else:
+            expired = self._execute([(self.sql['expired'], (cutoff,))])
+
+        for thread_id in expired:
+            self.saver.delete_thread(thread_id)
+            if self.backend == 'memory':
+                self._last_seen.pop(thread_id, None)
+            else:
+                self._execute([(self.sql['forget'], (thread_id,))])
+
+        if expired:
+            log.info(f'Evicted {len(expired)} expired conversation threads')
+
+        return len(expired)
+
+
+class AsyncCheckpointManager(_RetentionPolicy):
+    """
+        Creates the configured checkpointer for an asynchronous graph and applies the
+        retention policy after every conversation turn. The async savers bind to the
+        running event loop, so `asetup` must be awaited inside it. When it is awaited
+        from another event loop (e.g. a new `asyncio.run` per Streamlit rerun), the
+        database connection is re-opened on that loop. The connection is closed by
+        `aclose`, or by using the manager as an async context manager.
+    """
+    _loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def asetup(self) -> BaseCheckpointSaver:
+        loop = asyncio.get_running_loop()
+        if self.saver is not None and (self.backend == 'memory' or self._loop is loop):
+            return self.saver
+
+        if self.saver is not None:
+            try:
+                await self.aclose()
+            except Exception as e:
+                log.warning(f'Could not close checkpointer bound to a previous event loop: {e}')
+                self.saver = None
+        self._loop = loop
+
+        if self.backend == 'memory':
+            self.saver = InMemorySaver(serde=self.serde)
+
+        elif self.backend == 'sqlite':
+            import aiosqlite
+            from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+            Path(self.db_uri).parent.mkdir(parents=True, exist_ok=True)
+            conn = aiosqlite.connect(self.db_uri)
+            if isinstance(conn, threading.Thread):
+                # aiosqlite runs the connection in its own thread, a daemon one does not
+                # keep the interpreter from exiting when aclose is never awaited
+                conn.daemon = True
+            self.saver = AsyncSqliteSaver(conn, serde=self.serde)
+            await self.saver.setup()
+            async with self.saver.lock:
+                await self.saver.conn.execute(ACTIVITY_DDL)
+                await self.saver.conn.commit()
+
+        else:
+            from psycopg.rows import dict_row
+            from psycopg_pool import AsyncConnectionPool
+            from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+
+            pool = AsyncConnectionPool(
+                conninfo=self.db_uri,
+                max_size=self.pool_size,
+                kwargs={'autocommit': True, 'prepare_threshold': 0, 'row_factory': dict_row},
+                open=False,
+            )
+            await pool.open()
+            self.saver = AsyncPostgresSaver(pool, serde=self.serde)
+            await self.saver.setup()
+            async with pool.connection() as conn:
+                await conn.execute(ACTIVITY_DDL)
+
+        log.info(f'Using {self.backend} checkpointer')
+
+        return self.saver
+
+
+    async def aclose(self) -> None:
+        """
+            Closes the database connection (or pool) of the checkpointer, to be awaited
+            before the event loop stops so pending writes are flushed and the sqlite
+            file is released.
+        """
+        if self.saver is not None and self.backend != 'memory':
+            await self.saver.conn.close()
+        self.saver = None
+        self._loop = None
+
+
+    async def __aenter__(self) -> 'AsyncCheckpointManager':
+        await self.asetup()
+
+        return self
+
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+
+    async def _aexecute(self, statements: list[tuple[str, tuple]]) -> list:
+        rows = []
+        if self.backend == 'sqlite':
+            async with self.saver.lock:
+                for query, params in statements:
+                    async with self.saver.conn.execute(query, params) as cur:
+                        rows.extend(row[0] for row in await cur.fetchall())
+                await self.saver.conn.commit()
+        else:
+            async with self.saver.conn.connection() as conn:
+                for query, params in statements:
+                    cursor = await conn.execute(query, params)
+                    if cursor.description:
+                        rows.extend(row['thread_id'] for row in await cursor.fetchall())
+
+        return rows
+
+
+    async def aafter_turn(self, thread_id: str) -> None:
+        """
+            Records thread activity, prunes old checkpoints of the thread and
+            periodically deletes expired threads
+        """
+        thread_id = str(thread_id)
+        if self.backend == 'memory':
+            self._last_seen[thread_id] = time.time()
+            _prune_memory_thread(self.saver, thread_id, self.keep_last)
+
+        else:
+            statements = [
+                (self.sql['touch'], (thread_id, time.time())),
+                (self.sql['prune_checkpoints'], (thread_id, thread_id, self.keep_last)),
+                (self.sql['prune_writes'], (thread_id, thread_id)),
+            ]
+            if 'prune_blobs' in self.sql:
+                statements.append((self.sql['prune_blobs'], (thread_id,)))
+            await self._aexecute(statements)
+
+        if self._eviction_due():
+            await self.aevict_expired()
+
+
+    async def aevict_expired(self) -> int:
+        """
+            Deletes every thread inactive for longer than the TTL
+
+            Returns:
+                int: Number of deleted threads
+        """
+        cutoff = time.time() - self.ttl
+        if self.backend == 'memory':
+            expired = [thread_id for thread_id, last_seen in self._last_seen.items() if last_seen < cutoff]
+        else:
+            expired = await self._aexecute([(self.sql['expired'], (cutoff,))])
+
+        for thread_id in expired:
+            await self.saver.adelete_thread(thread_id)
+            if self.backend == 'memory':
+                self._last_seen.pop(thread_id, None)
+            else:
+                await self._aexecute([(self.sql['forget'], (thread_id,))])
+
+        if expired:
+            log.info(f'Evicted {len(expired)} expired conversation threads')
+
+        return len(expired)
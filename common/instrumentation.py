@@ -0,0 +1,384 @@
+"""
+    Per-node timing and token accounting of the LangGraph agents.
+
+    - `instrument_node` wraps a node and records its wall time and errors
+    - `InstrumentationCallbackHandler` records the latency and the prompt / completion
+      tokens of every LLM call, attributed to the node and thread that made it
+    - `record_cache_hit` counts cache hits (retrieval, knowledge graph, web search,
+      semantic answer cache) of the node being run
+
+    INSTRUMENTATION_ENABLED turns it on. Statistics are then kept in memory per thread
+    and per node (`instrumentation.thread_stats(thread_id)`, `instrumentation.node_totals()`)
+    and can also be exported, INSTRUMENTATION_EXPORTERS being a comma-separated list of:
+        - 'otel': an OpenTelemetry span per node and per LLM call (the application
+          configures the OpenTelemetry SDK and its exporter)
+        - 'prometheus': node / LLM latency histograms and token / cache hit counters,
+          labelled by node (not by thread, to bound their cardinality), served on
+          INSTRUMENTATION_PROMETHEUS_PORT when it is set
+    When disabled, nodes and graphs are returned unwrapped and nothing is recorded.
+"""
+import os
+import time
+import asyncio
+import threading
+import functools
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator, Optional
+from uuid import UUID
+
+from loguru import logger as log
+from pydantic import BaseModel
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+
+INSTRUMENTATION_ENABLED = os.environ.get('INSTRUMENTATION_ENABLED', 'false').lower() == 'true'
+INSTRUMENTATION_EXPORTERS = [
+    exporter.strip() for exporter in os.environ.get('INSTRUMENTATION_EXPORTERS', '').split(',') if exporter.strip()
+]
+INSTRUMENTATION_PROMETHEUS_PORT = os.environ.get('INSTRUMENTATION_PROMETHEUS_PORT')
+INSTRUMENTATION_MAX_THREADS = int(os.environ.get('INSTRUMENTATION_MAX_THREADS', 1000))
+
+NO_THREAD = '-'
+
+# (thread id, node) of the node being run
+_current_node: ContextVar[Optional[tuple[str, str]]] = ContextVar('current_node', default=None)
+
+
+class NodeStats(BaseModel):
+    """Accumulated measurements of a node."""
+
+    calls: int = 0
+    errors: int = 0
+    wall_time: float = 0.0          # seconds spent in the node
+    llm_calls: int = 0
+    llm_time: float = 0.0           # seconds spent waiting for LLM calls
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cache_hits: int = 0
+
+    def add(self, other: 'NodeStats') -> None:
+        for field in type(self).model_fields:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+
+
+def _thread_id(config: Optional[RunnableConfig]) -> str:
+    thread_id = ((config or {}).get('configurable') or {}).get('thread_id')
+
+    return str(thread_id) if thread_id is not None else NO_THREAD
+
+
+class _PrometheusMetrics:
+    def __init__(self, port: Optional[str] = None):
+        from prometheus_client import Counter, Histogram, start_http_server
+
+        self.node_duration = Histogram('agent_node_duration_seconds', 'Wall time of graph nodes', ['node'])
+        self.node_errors = Counter('agent_node_errors_total', 'Graph nodes that raised', ['node'])
+        self.llm_duration = Histogram('agent_llm_duration_seconds', 'Latency of LLM calls', ['node', 'model'])
+        self.llm_tokens = Counter('agent_llm_tokens_total', 'Tokens of LLM calls', ['node', 'model', 'kind'])
+        self.cache_hits = Counter('agent_cache_hits_total', 'Cache hits', ['node', 'cache'])
+        if port:
+            start_http_server(int(port))
+
+
+class Instrumentation:
+    """
+        Collects the measurements of the nodes and LLM calls and forwards them to the exporters.
+        Statistics of the least recently active threads are dropped beyond `max_threads`.
+    """
+    def __init__(
+            self,
+            enabled: bool = INSTRUMENTATION_ENABLED,
+            exporters: list[str] = INSTRUMENTATION_EXPORTERS,
+            max_threads: int = INSTRUMENTATION_MAX_THREADS
+        ):
+        self.enabled = enabled
+        self.max_threads = max_threads
+        self.tracer = None
+        self.prometheus = None
+        self._lock = threading.Lock()
+        self._threads: OrderedDict[str, dict[str, NodeStats]] = OrderedDict()
+
+        if not enabled:
+            return
+
+        for exporter in exporters:
+            try:
+                if exporter == 'otel':
+                    from opentelemetry import trace
+                    self.tracer = trace.get_tracer('genai_agents')
+                elif exporter == 'prometheus':
+                    self.prometheus = _PrometheusMetrics(INSTRUMENTATION_PROMETHEUS_PORT)
+                else:
+                    log.warning(f'Unknown instrumentation exporter: {exporter}')
+            except ImportError as e:
+                log.warning(f'Instrumentation exporter {exporter} is not available: {e}')
+
+
+    def _stats(self, thread_id: str, node: str) -> NodeStats:
+        # callers hold the lock
+        nodes = self._threads.get(thread_id)
+        if nodes is None:
+            nodes = self._threads[thread_id] = {}
+            while len(self._threads) > self.max_threads:
+                self._threads.popitem(last=False)
+        self._threads.move_to_end(thread_id)
+
+        return nodes.setdefault(node, NodeStats())
+
+
+    def record_node(self, thread_id: str, node: str, seconds: float, error: bool = False) -> None:
+        with self._lock:
+            stats = self._stats(thread_id, node)
+            stats.calls += 1
+            stats.errors += error
+            stats.wall_time += seconds
+
+        if self.prometheus:
+            self.prometheus.node_duration.labels(node).observe(seconds)
+            if error:
+                self.prometheus.node_errors.labels(node).inc()
+
+
+    def record_llm(
+            self,
+            thread_id: str,
+            node: str,
+            model: str,
+            seconds: float,
+            prompt_tokens: int,
+            completion_tokens: int
+        ) -> None:
+        with self._lock:
+            stats = self._stats(thread_id, node)
+            stats.llm_calls += 1
+            stats.llm_time += seconds
+            stats.prompt_tokens += prompt_tokens
+            stats.completion_tokens += completion_tokens
+
+        if self.prometheus:
+            self.prometheus.llm_duration.labels(node, model).observe(seconds)
+            self.prometheus.llm_tokens.labels(node, model, 'prompt').inc(prompt_tokens)
+            self.prometheus.llm_tokens.labels(node, model, 'completion').inc(completion_tokens)
+
+
+    def record_cache_hit(self, cache: str) -> None:
+        thread_id, node = _current_node.get() or (NO_THREAD, '-')
+        with self._lock:
+            self._stats(thread_id, node).cache_hits += 1
+
+        if self.prometheus:
+            self.prometheus.cache_hits.labels(node, cache).inc()
+
+
+    @contextmanager
+    def node_span(self, node: str, config: Optional[RunnableConfig] = None) -> Iterator[None]:
+        """
+            Times a node run, the node and thread are the context of the LLM calls and
+            cache hits made inside it
+        """
+        thread_id = _thread_id(config)
+        token = _current_node.set((thread_id, node))
+        span = self.tracer.start_as_current_span(
+            f'node {node}', attributes={'agent.node': node, 'agent.thread_id': thread_id}
+        ) if self.tracer else None
+
+        start = time.perf_counter()
+        error = False
+        try:
+            if span is None:
+                yield
+            else:
+                with span:
+                    yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.record_node(thread_id, node, time.perf_counter() - start, error)
+            _current_node.reset(token)
+
+
+    def thread_stats(self, thread_id: str) -> dict[str, NodeStats]:
+        """
+            Statistics of a thread, per node
+        """
+        with self._lock:
+            return {node: stats.model_copy() for node, stats in self._threads.get(thread_id, {}).items()}
+
+
+    def node_totals(self) -> dict[str, NodeStats]:
+        """
+            Statistics of every node, summed over the threads
+        """
+        totals: dict[str, NodeStats] = {}
+        with self._lock:
+            for nodes in self._threads.values():
+                for node, stats in nodes.items():
+                    totals.setdefault(node, NodeStats()).add(stats)
+
+        return totals
+
+
+    def clear(self) -> None:
+        with self._lock:
+            self._threads.clear()
+
+
+class InstrumentationCallbackHandler(BaseCallbackHandler):
+    """
+        Measures the LLM calls. The node and thread come from the metadata LangGraph
+        adds to the run config, or from the node being run.
+    """
+    run_inline = True
+
+    def __init__(self, instrumentation: Instrumentation):
+        self.instrumentation = instrumentation
+        self._runs: dict[UUID, tuple[float, str, str, str]] = {}
+
+
+    def _on_start(self, run_id: UUID, serialized: Optional[dict], metadata: Optional[dict], kwargs: dict) -> None:
+        metadata = metadata or {}
+        thread_id, node = _current_node.get() or (NO_THREAD, '-')
+        params = kwargs.get('invocation_params') or {}
+        model = (
+            metadata.get('ls_model_name') or params.get('model_name') or params.get('model')
+            or (serialized or {}).get('name') or 'unknown'
+        )
+        self._runs[run_id] = (
+            time.perf_counter(),
+            str(metadata['thread_id']) if metadata.get('thread_id') is not None else thread_id,
+            metadata.get('langgraph_node', node),
+            model,
+        )
+
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs) -> None:
+        self._on_start(run_id, serialized, metadata, kwargs)
+
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs) -> None:
+        self._on_start(run_id, serialized, metadata, kwargs)
+
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+
+        start, thread_id, node, model = run
+        seconds = time.perf_counter() - start
+        prompt_tokens, completion_tokens = token_usage(response)
+        self.instrumentation.record_llm(thread_id, node, model, seconds, prompt_tokens, completion_tokens)
+
+        if self.instrumentation.tracer:
+            end_ns = time.time_ns()
+            span = self.instrumentation.tracer.start_span(
+                f'llm {model}',
+                start_time=end_ns - int(seconds * 1e9),
+                attributes={
+                    'agent.node': node,
+                    'agent.thread_id': thread_id,
+                    'gen_ai.request.model': model,
+                    'gen_ai.usage.input_tokens': prompt_tokens,
+                    'gen_ai.usage.output_tokens': completion_tokens,
+                }
+            )
+            span.end(end_time=end_ns)
+
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs) -> None:
+        self._runs.pop(run_id, None)
+
+
+def token_usage(response: LLMResult) -> tuple[int, int]:
+    """
+        Prompt and completion tokens of an LLM response, from the usage metadata of
+        the messages, else from the provider output
+    """
+    prompt_tokens = completion_tokens = 0
+    found = False
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, 'message', None), 'usage_metadata', None)
+            if usage:
+                found = True
+                prompt_tokens += usage.get('input_tokens', 0)
+                completion_tokens += usage.get('output_tokens', 0)
+
+    if not found:
+        usage = (response.llm_output or {}).get('token_usage') or {}
+        prompt_tokens = usage.get('prompt_tokens', 0)
+        completion_tokens = usage.get('completion_tokens', 0)
+
+    return prompt_tokens, completion_tokens
+
+
+instrumentation = Instrumentation()
+
+
+def record_cache_hit(cache: str) -> None:
+    if instrumentation.enabled:
+        instrumentation.record_cache_hit(cache)
+
+
+def instrument_node(node: Callable | Runnable, name: Optional[str] = None) -> Callable | Runnable:
+    """
+        Wraps a graph node (sync or async function, or runnable such as a ToolNode)
+        to time it. The wrapper keeps the name and signature of a function node, so
+        it is added to the graph the same way. Returns the node itself when disabled.
+    """
+    if not instrumentation.enabled:
+        return node
+
+    if isinstance(node, Runnable):
+        name = name or node.get_name()
+
+        def run(state, config: RunnableConfig):
+            with instrumentation.node_span(name, config):
+                return node.invoke(state, config)
+
+        async def arun(state, config: RunnableConfig):
+            with instrumentation.node_span(name, config):
+                return await node.ainvoke(state, config)
+
+        return RunnableLambda(run, afunc=arun, name=name)
+
+    name = name or node.__name__
+    if asyncio.iscoroutinefunction(node):
+        @functools.wraps(node)
+        async def async_wrapper(*args, **kwargs):
+            with instrumentation.node_span(name, _get_config()):
+                return await node(*args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(node)
+    def wrapper(*args, **kwargs):
+        with instrumentation.node_span(name, _get_config()):
+            return node(*args, **kwargs)
+
+    return wrapper
+
+
+def _get_config() -> Optional[RunnableConfig]:
+    from langgraph.config import get_config
+
+    try:
+        return get_config()
+    except RuntimeError:
+        return None
+
+
+def instrument_graph(graph: Runnable) -> Runnable:
+    """
+        Attaches the LLM callback handler to a compiled graph, it is inherited by
+        every LLM call made in its nodes (including the ones of sub-agents)
+    """
+    if not instrumentation.enabled:
+        return graph
+
+    return graph.with_config(callbacks=[InstrumentationCallbackHandler(instrumentation)])
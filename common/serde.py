@@ -0,0 +1,83 @@
+"""
+    Checkpoint serializer with dedicated msgpack extension types for LangChain
+    messages and documents, the bulk of the state stored by the agents.
+
+    Messages are stored as their class name and non-default fields, documents as
+    their fields, so both round-trip losslessly without the module lookup of
+    langgraph's generic pydantic extension and with smaller payloads. Every other
+    object is handled by the default langgraph encoder.
+"""
+from typing import Any
+
+import ormsgpack
+from langchain_core.documents import Document
+from langchain_core.messages import (
+    AIMessage, AIMessageChunk, BaseMessage, ChatMessage, ChatMessageChunk, FunctionMessage,
+    FunctionMessageChunk, HumanMessage, HumanMessageChunk, SystemMessage, SystemMessageChunk,
+    ToolMessage, ToolMessageChunk,
+)
+from langgraph.checkpoint.serde.jsonplus import (
+    JsonPlusSerializer, _msgpack_default, _msgpack_ext_hook, _option,
+)
+
+
+# langgraph uses extension codes 0-6, keep ours well clear of them
+EXT_LC_MESSAGE = 100
+EXT_LC_DOCUMENT = 101
+
+MESSAGE_TYPES = {
+    cls.__name__: cls for cls in (
+        AIMessage, AIMessageChunk, ChatMessage, ChatMessageChunk, FunctionMessage, FunctionMessageChunk,
+        HumanMessage, HumanMessageChunk, SystemMessage, SystemMessageChunk, ToolMessage, ToolMessageChunk,
+    )
+}
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, BaseMessage) and MESSAGE_TYPES.get(type(obj).__name__) is type(obj):
+        return ormsgpack.Ext(EXT_LC_MESSAGE, pack((type(obj).__name__, obj.model_dump(exclude_defaults=True))))
+
+    if type(obj) is Document:
+        return ormsgpack.Ext(EXT_LC_DOCUMENT, pack((obj.page_content, obj.metadata, obj.id)))
+
+    return _msgpack_default(obj)
+
+
+def _ext_hook(code: int, data: bytes) -> Any:
+    if code == EXT_LC_MESSAGE:
+        name, fields = unpack(data)
+        return MESSAGE_TYPES[name](**fields)
+
+    if code == EXT_LC_DOCUMENT:
+        page_content, metadata, id_ = unpack(data)
+        return Document(page_content=page_content, metadata=metadata, id=id_)
+
+    return _msgpack_ext_hook(code, data)
+
+
+def pack(obj: Any) -> bytes:
+    return ormsgpack.packb(obj, default=_default, option=_option)
+
+
+def unpack(data: bytes) -> Any:
+    return ormsgpack.unpackb(data, ext_hook=_ext_hook, option=ormsgpack.OPT_NON_STR_KEYS)
+
+
+class MessageSerializer(JsonPlusSerializer):
+    """
+        JsonPlusSerializer that encodes messages and documents with the typed
+        extensions above. Checkpoints written by the default serializer stay readable.
+    """
+    def __init__(self, *, pickle_fallback: bool = False):
+        super().__init__(pickle_fallback=pickle_fallback, __unpack_ext_hook__=_ext_hook)
+
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        if obj is None or isinstance(obj, (bytes, bytearray)):
+            return super().dumps_typed(obj)
+
+        try:
+            return 'msgpack', pack(obj)
+        except ormsgpack.MsgpackEncodeError:
+            # invalid UTF-8 and unsupported types keep the JSON / pickle fallbacks
+            return super().dumps_typed(obj)
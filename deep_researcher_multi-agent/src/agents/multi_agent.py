@@ -1,6 +1,7 @@
 import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parents[1]))
+sys.path.append(str(Path(__file__).resolve().parents[3]))
 
 from src.state import AgentState
 from src.helper import make_supervisor_node
@@ -17,6 +18,8 @@ from langgraph.types import Command
 from langgraph.graph import StateGraph
 from langchain_openai import ChatOpenAI
 
+from common.instrumentation import instrument_graph, instrument_node
+
 
 def plan_node(state: AgentState) -> Command[Literal['supervisor']]:   
     message = HumanMessage(
@@ -114,12 +117,12 @@ def build_research_team():
     
     graph = (
         StateGraph(AgentState)
-        .add_node('supervisor', research_supervisor_node)
-        .add_node('plan', plan_node)
-        .add_node('research', research_node)
-        .add_node('write', write_node)
-        .add_node('edit', edit_node)
+        .add_node('supervisor', instrument_node(research_supervisor_node, 'supervisor'))
+        .add_node('plan', instrument_node(plan_node))
+        .add_node('research', instrument_node(research_node))
+        .add_node('write', instrument_node(write_node))
+        .add_node('edit', instrument_node(edit_node))
         .set_entry_point('supervisor')
     ).compile()
     
-    return graph
\ No newline at end of file
+    return instrument_graph(graph)
\ No newline at end of file
@@ -1,30 +1,27 @@
 import sys
 import os
 import re
-import ast
 import asyncio
 import unicodedata
 from pathlib import Path
 
 
 sys.path.append(str(Path(__file__).resolve().parents[1]))
+sys.path.append(str(Path(__file__).resolve().parents[3]))
 
 from pydantic import BaseModel, Field
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
-from langchain_community.tools import BraveSearch
 from langchain_community.document_loaders import WebBaseLoader
 from langgraph.graph import StateGraph
 
 from src.prompts import search_query_generation_prompt
 from src.state import AgentState
 from src.utils import BaseAgent
+from common.brave_search import SearchResult, get_search_client
 
 
-search_tool = BraveSearch.from_api_key(
-    api_key=os.environ.get('BRAVE_SEARCH_API_KEY'),
-    search_kwargs={'count': 3}
-)
+search_tool = get_search_client(os.environ.get('BRAVE_SEARCH_API_KEY'))
 
 
 class SearchQuery(BaseModel):
@@ -115,39 +112,26 @@ class ResearchAgent(BaseAgent):
         return raw_content
     
     
-    async def deduplicate_and_format_sources(self, search_results: list[str]) -> str:
+    async def deduplicate_and_format_sources(self, search_results: list[list[SearchResult]]) -> str:
         """
             Removes duplicates and format sources
         """
         try:
-            parsed_results = []
-            for result in search_results:
-                try:
-                    if result and result != "[]":
-                        parsed = ast.literal_eval(result)
-                        parsed_results.append(parsed)
-                except (ValueError, SyntaxError) as e:
-                    print(f"Failed to parse search result: {e}")
-                    continue
-            
-            if not parsed_results:
-                return "No sources found"
-                
-            search_results = [item for sublist in parsed_results for item in sublist]
+            search_results = [item for sublist in search_results for item in sublist]
             
             if not search_results:
-                return "No sources found after parsing"
+                return "No sources found"
                 
-            unique_sources = {web_result['link'] for web_result in search_results}
+            unique_sources = {web_result.link for web_result in search_results}
             docs = await self.load_all_fast(unique_sources)
             doc_lookup = {doc.metadata['source']: self.clean_text(doc.page_content) for doc in docs}
             
             formatted_text = "Sources: \n\n"
             for i, result in enumerate(search_results, 1):
-                formatted_text += f"Source {i} - {result['title']}:\n===\n"
-                formatted_text += f"URL: {result['link']}\n===\n"
-                formatted_text += f"Most relevant content from source: {result['snippet']}\n===\n"
-                formatted_text += doc_lookup.get(result['link'], 'No content available')
+                formatted_text += f"Source {i} - {result.title}:\n===\n"
+                formatted_text += f"URL: {result.link}\n===\n"
+                formatted_text += f"Most relevant content from source: {result.snippet}\n===\n"
+                formatted_text += doc_lookup.get(result.link, 'No content available')
                 
             return formatted_text
         except Exception as e:
@@ -156,23 +140,17 @@ class ResearchAgent(BaseAgent):
     
     
     
-    async def brave_search_async(self, queries: list[str]) -> list:
+    async def brave_search_async(self, queries: list[str]) -> list[list[SearchResult]]:
         """
-            Performs Brave Search on queries asynchronously
+            Performs Brave Search on queries asynchronously. Rate limiting and retries
+            (with a capped number of attempts) are handled by the shared search client.
         """
         async def search(query):
-            while True:
-                try:
-                    result = await search_tool.ainvoke(query)
-                    if result:
-                        return result
-                    await asyncio.sleep(0.5)
-                except Exception as e:
-                    if "429" in str(e):
-                        await asyncio.sleep(0.5)
-                    else:
-                        print(f"Error searching for {query}: {e}")
-                        return "[]"  
+            try:
+                return await search_tool.asearch(query, count=3)
+            except Exception as e:
+                print(f"Error searching for {query}: {e}")
+                return []
 
         results = await asyncio.gather(*[search(q) for q in queries])
         return results
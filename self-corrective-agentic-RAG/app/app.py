@@ -2,13 +2,15 @@ import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
-from src.graph import interact_with_agent
+from src.graph import health_check, shutdown, startup, stream_agent
 
+import atexit
 import asyncio
-import nest_asyncio
 import random
+import threading
+from typing import AsyncIterator, Iterator
 import streamlit as st
-nest_asyncio.apply()
+from loguru import logger as log
 
 
 def generate_thread_id():
@@ -20,19 +22,64 @@ st.set_page_config(
     layout="wide",
 )
 
-async def get_response(query: str, thread_id: str):
+@st.cache_resource
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+        One event loop, running in a background thread, shared by every chat session.
+        The agent, its checkpointer and the knowledge graph pool stay bound to it
+        instead of being re-created by an `asyncio.run` on every rerun.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    # the loop and the aiosqlite connection threads are daemons, so they are still running at exit
+    atexit.register(close_event_loop, loop)
     
-    return await interact_with_agent(
-        query=query,
-        thread_id=thread_id
-    )
+    return loop
 
 
-async def run_app() -> None:
+@st.cache_resource
+def start_agent() -> bool:
+    """
+        Opens the checkpointer and the knowledge graph pool once per process
+
+        Returns:
+            bool: Whether the knowledge graph is reachable
+    """
+    return asyncio.run_coroutine_threadsafe(startup(), get_event_loop()).result()
+
+
+def close_event_loop(loop: asyncio.AbstractEventLoop) -> None:
+    """
+        Closes the knowledge graph drivers and the checkpointer connection on the
+        shared event loop, then stops the loop
+    """
+    try:
+        asyncio.run_coroutine_threadsafe(shutdown(), loop).result(timeout=10)
+    except Exception as e:
+        log.warning(f'Could not close the agent resources: {e}')
+    loop.call_soon_threadsafe(loop.stop)
+
+
+def iterate(events: AsyncIterator[dict]) -> Iterator[dict]:
+    """
+        Consumes an async generator on the shared event loop from the script thread
+    """
+    loop = get_event_loop()
+    while True:
+        try:
+            yield asyncio.run_coroutine_threadsafe(events.__anext__(), loop).result()
+        except StopAsyncIteration:
+            return
+
+
+def run_app() -> None:
     st.title('Agentic RAG 🤖')
 
     with st.sidebar:
         st.text_input(label='Enter your OpenAI API Key', key='openAI_api_key', type='password')
+        # checked again on every rerun while the knowledge graph is down, so the warning clears once it is back
+        if not (start_agent() or asyncio.run_coroutine_threadsafe(health_check(), get_event_loop()).result()):
+            st.warning('The knowledge graph is unreachable, answers use the other sources only.')
 
     if st.session_state.get('openAI_api_key'):
         if st.button("New Chat"):
@@ -53,15 +100,26 @@ async def run_app() -> None:
                 st.markdown(user_query)
             st.session_state.messages.append({"role": "user", "content": user_query})
 
-            with st.spinner('Thinking...'):
+            with st.chat_message('assistant'):
                 try:
-                    response = await interact_with_agent(
+                    status = st.status('Thinking...')
+                    placeholder = st.empty()
+                    response = ''
+                    
+                    for event in iterate(stream_agent(
                         query=user_query,
                         thread_id=st.session_state['thread_id']
-                    )
-
-                    with st.chat_message('assistant'):
-                        st.markdown(response)
+                    )):
+                        if event['type'] == 'node':
+                            status.update(label=f"Completed: {event['name']}")
+                        elif event['type'] == 'token':
+                            response += event['content']
+                            placeholder.markdown(response + '▌')
+                        else:
+                            response = event['content']
+                    
+                    status.update(label='Done', state='complete')
+                    placeholder.markdown(response)
                     st.session_state['messages'].append(
                         {
                             'role': 'assistant',
@@ -76,4 +134,4 @@ async def run_app() -> None:
 
 
 if __name__ == '__main__':
-    asyncio.run(run_app())
\ No newline at end of file
+    run_app()
\ No newline at end of file
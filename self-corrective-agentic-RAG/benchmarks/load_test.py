@@ -0,0 +1,104 @@
+"""
+    Load test of concurrent chat sessions served by a single process / event loop.
+
+    Every session gets its own thread id and asks the questions one after the other,
+    all sessions run concurrently. Besides throughput and latency, the script measures
+    the event loop lag (how late a 10 ms ticker wakes up): blocking calls inside the
+    nodes show up there, since they stall every other session.
+
+    A node blocking the event loop shows up as a max lag about as long as the
+    blocking call, while with the async nodes the lag stays in the milliseconds.
+
+    Usage:
+        python benchmarks/load_test.py --sessions 1 5 20
+
+    The agent calls the real OpenAI / Brave / Neo4j services, so it needs the same
+    .env as the app and costs API credits, and its latencies depend on those services.
+    For repeatable numbers, e.g. to compare two versions of the nodes, use the offline
+    benchmark (benchmarks/offline_benchmark.py), which runs the graph against local
+    stand-ins with fixed simulated latencies.
+"""
+import sys
+import time
+import uuid
+import asyncio
+import argparse
+import statistics
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from src.graph import interact_with_agent, shutdown, startup
+
+
+DEFAULT_QUESTIONS = [
+    'Why were the Apple Intelligence features delayed?',
+    'What changes were made to the Siri leadership?',
+    'How is Apple positioned against its competitors in AI?',
+]
+
+
+async def measure_loop_lag(lags: list[float], stop: asyncio.Event, interval: float = 0.01) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def run_session(questions: list[str], latencies: list[float], errors: list[str]) -> None:
+    thread_id = str(uuid.uuid4())
+    for question in questions:
+        start = time.perf_counter()
+        try:
+            await interact_with_agent(query=question, thread_id=thread_id)
+            latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            errors.append(repr(e))
+
+
+async def run_load(sessions: int, questions: list[str]) -> dict:
+    latencies, errors, lags = [], [], []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(measure_loop_lag(lags, stop))
+
+    start = time.perf_counter()
+    await asyncio.gather(*[run_session(questions, latencies, errors) for _ in range(sessions)])
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await ticker
+
+    return {
+        'sessions': sessions,
+        'turns': len(latencies),
+        'errors': len(errors),
+        'elapsed': elapsed,
+        'throughput': len(latencies) / elapsed,
+        'p50': statistics.median(latencies) if latencies else float('nan'),
+        'p95': statistics.quantiles(latencies, n=20)[-1] if len(latencies) >= 2 else float('nan'),
+        'max_lag': max(lags, default=0.0),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Concurrent chat sessions load test')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 5, 20], help='concurrent sessions per run')
+    parser.add_argument('--questions', type=str, nargs='+', default=DEFAULT_QUESTIONS, help='questions asked by each session')
+    args = parser.parse_args()
+
+    print(f"{'sessions':>8} {'turns':>6} {'errors':>6} {'elapsed s':>10} {'turns/s':>8} {'p50 s':>7} {'p95 s':>7} {'max lag s':>10}")
+    # the knowledge graph drivers and the checkpointer connection are closed on exit
+    await startup()
+    try:
+        for sessions in args.sessions:
+            r = await run_load(sessions, args.questions)
+            print(
+                f"{r['sessions']:>8} {r['turns']:>6} {r['errors']:>6} {r['elapsed']:>10.2f} {r['throughput']:>8.2f} "
+                f"{r['p50']:>7.2f} {r['p95']:>7.2f} {r['max_lag']:>10.3f}"
+            )
+    finally:
+        await shutdown()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
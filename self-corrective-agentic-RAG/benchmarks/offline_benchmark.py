@@ -0,0 +1,431 @@
+"""
+    Offline benchmark of the self-corrective RAG graph: the real nodes, routing,
+    checkpointer and context packing run against local stand-ins of the services,
+    so it needs no API key, costs nothing and gives repeatable numbers.
+
+        - chat model: deterministic fake (tool call, relevance grades, answers),
+          a configurable fraction of the documents is graded irrelevant so the
+          query rewrite + web search path is exercised too
+        - embeddings: deterministic fake vectors
+        - vector store: the `memory` vector backend (in-memory Qdrant) seeded with a synthetic corpus,
+          reranked by word overlap instead of the Flashrank model
+        - knowledge graph and Brave search: stubs
+    Every stand-in waits a simulated latency (mean +- jitter) before answering.
+
+    For each concurrency level, the requests (one question per new thread) are run
+    with at most `concurrency` in flight, and the script reports the requests/s and
+    the p50 / p95 / p99 latency end to end and per node.
+
+    With `--blocking-nodes` the nodes run the way they did before they were made
+    async, for a before / after comparison: each node is a sync function, which
+    LangGraph runs on its thread pool, and every service call in it blocks
+    (`.invoke` instead of `.ainvoke`), so documents are graded one at a time and
+    the web search is not started speculatively.
+
+    Usage:
+        python benchmarks/offline_benchmark.py --concurrency 1 8 32 --requests 200
+        python benchmarks/offline_benchmark.py --llm-latency 0.3 --kg-latency 0.1 --irrelevant-rate 0.5
+        python benchmarks/offline_benchmark.py --concurrency 1 8 32 --blocking-nodes
+
+    The token counting (history window, context budget) uses tiktoken, whose
+    encoding files must already be in the local tiktoken cache.
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import hashlib
+import functools
+import tempfile
+import statistics
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional, Sequence
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import Document
+from langchain_core.documents.compressor import BaseDocumentCompressor
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from common.brave_search import SearchResult
+
+
+EMBEDDING_SIZE = 256
+
+TOPICS = [
+    ('Apple Intelligence', 'delayed', 'Siri features slipped to the next release after internal testing'),
+    ('Siri leadership', 'reorganized', 'the assistant team moved under a new engineering lead'),
+    ('on-device models', 'optimized', 'smaller models run locally to protect user privacy'),
+    ('Private Cloud Compute', 'launched', 'server-side requests run on Apple silicon in audited data centers'),
+    ('competitors', 'compared', 'rivals shipped assistants built on large language models earlier'),
+    ('acquisitions', 'considered', 'the company weighed buying AI startups to catch up'),
+    ('developer tools', 'released', 'new APIs let apps call the foundation models'),
+    ('hardware', 'upgraded', 'more memory was added to run the models on phones'),
+]
+
+# simulated latencies (seconds) and jitter, set from the command line
+LATENCY = {'llm': 0.2, 'embedding': 0.02, 'kg': 0.05, 'search': 0.3, 'jitter': 0.2}
+IRRELEVANT_RATE = 0.2
+# service calls block the calling thread, as the sync `.invoke` calls of the former nodes did
+BLOCKING = False
+_random = random.Random(0)
+
+
+def simulated_latency(service: str) -> float:
+    jitter = LATENCY['jitter']
+
+    return LATENCY[service] * _random.uniform(1 - jitter, 1 + jitter)
+
+
+def fraction(text: str) -> float:
+    # deterministic number in [0, 1) derived from a text
+    return int(hashlib.md5(text.encode()).hexdigest()[:8], 16) / 16 ** 8
+
+
+class FakeChatModel(BaseChatModel):
+    """
+        Stand-in for ChatOpenAI. Answers depend only on the prompt, so every run of
+        the benchmark takes the same paths through the graph.
+    """
+    model: str = 'fake'
+    answer_words: int = 60
+
+    @property
+    def _llm_type(self) -> str:
+        return 'fake-chat'
+
+
+    def bind_tools(self, tools: Sequence[Any], *, tool_choice: Optional[str] = None, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+
+    def respond(self, messages: list[BaseMessage], tools: Optional[list[dict]] = None) -> AIMessage:
+        tool_names = {tool['function']['name'] for tool in tools or []}
+        prompt = messages[-1].content if messages else ''
+
+        if 'GradeDocuments' in tool_names:
+            score = 'no' if fraction(prompt) < IRRELEVANT_RATE else 'yes'
+            return AIMessage(
+                content='',
+                tool_calls=[{'name': 'GradeDocuments', 'args': {'binary_score': score}, 'id': str(uuid.uuid4())}]
+            )
+
+        if 'retrieve_from_all_sources' in tool_names and isinstance(messages[-1], HumanMessage):
+            return AIMessage(
+                content='',
+                tool_calls=[{'name': 'retrieve_from_all_sources', 'args': {'question': prompt}, 'id': str(uuid.uuid4())}]
+            )
+
+        words = prompt.split() or ['answer']
+        return AIMessage(content=' '.join(words[i % len(words)] for i in range(self.answer_words)))
+
+
+    def _generate(self, messages, stop=None, run_manager=None, tools=None, **kwargs) -> ChatResult:
+        time.sleep(simulated_latency('llm'))
+
+        return ChatResult(generations=[ChatGeneration(message=self.respond(messages, tools))])
+
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, tools=None, **kwargs) -> ChatResult:
+        if BLOCKING:
+            return self._generate(messages, stop=stop, tools=tools, **kwargs)
+        
+        await asyncio.sleep(simulated_latency('llm'))
+
+        return ChatResult(generations=[ChatGeneration(message=self.respond(messages, tools))])
+
+
+class FakeEmbeddings(DeterministicFakeEmbedding):
+    """
+        Stand-in for OpenAIEmbeddings, the same text always gets the same vector
+    """
+    model: str = 'fake'
+    size: int = EMBEDDING_SIZE
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        time.sleep(simulated_latency('embedding'))
+
+        return [self._get_embedding(seed=self._get_seed(text)) for text in texts]
+
+
+    def embed_query(self, text: str) -> list[float]:
+        time.sleep(simulated_latency('embedding'))
+
+        return self._get_embedding(seed=self._get_seed(text))
+
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        if BLOCKING:
+            return self.embed_documents(texts)
+
+        return await super().aembed_documents(texts)
+
+
+    async def aembed_query(self, text: str) -> list[float]:
+        if BLOCKING:
+            return self.embed_query(text)
+
+        return await super().aembed_query(text)
+
+
+class OverlapReranker(BaseDocumentCompressor):
+    """
+        Stand-in for the Flashrank reranker: documents are scored by the share of
+        the query words they contain
+    """
+    top_n: int = 3
+
+    def compress_documents(
+            self,
+            documents: Sequence[Document],
+            query: str,
+            callbacks: Callbacks = None
+        ) -> Sequence[Document]:
+        query_words = set(query.lower().split())
+        scored = []
+        for doc in documents:
+            words = set(doc.page_content.lower().split())
+            score = len(query_words & words) / max(len(query_words), 1)
+            scored.append(Document(page_content=doc.page_content, metadata={**doc.metadata, 'relevance_score': score}))
+
+        return sorted(scored, key=lambda doc: doc.metadata['relevance_score'], reverse=True)[:self.top_n]
+
+
+class FakeSearchClient:
+    """
+        Stand-in for the Brave search client
+    """
+    async def asearch(self, query: str, count: Optional[int] = None) -> list[SearchResult]:
+        if BLOCKING:
+            time.sleep(simulated_latency('search'))
+        else:
+            await asyncio.sleep(simulated_latency('search'))
+
+        return [
+            SearchResult(title=f'Result {i}', link=f'https://example.com/{i}', snippet=f'Web result {i} about {query}')
+            for i in range(count or 3)
+        ]
+
+
+async def fake_search_knowledge_graph(query: str, limit: int = 5) -> list[str]:
+    if BLOCKING:
+        time.sleep(simulated_latency('kg'))
+    else:
+        await asyncio.sleep(simulated_latency('kg'))
+    topic, event, detail = TOPICS[int(fraction(query) * len(TOPICS))]
+
+    return [f'{topic} was {event}: {detail} (fact {i}).' for i in range(min(limit, 2))]
+
+
+def blocking_node(node):
+    """
+        Runs an async node as a sync node: LangGraph calls it on its thread pool, where
+        the node's awaits run one after another since every service call blocks
+    """
+    @functools.wraps(node)
+    def run(state):
+        return asyncio.run(node(state))
+
+    return run
+
+
+def make_corpus(n_docs: int) -> list[Document]:
+    """
+        Synthetic chunks, spread over the topics, sources and pages
+    """
+    docs = []
+    for i in range(n_docs):
+        topic, event, detail = TOPICS[i % len(TOPICS)]
+        docs.append(Document(
+            page_content=(
+                f'Report {i}: {topic} was {event}, {detail}. '
+                f'Analysts covering {topic.lower()} expect further changes in part {i % 7} of the roadmap.'
+            ),
+            metadata={'source': f'report_{i % 5}.pdf', 'page': i % 20}
+        ))
+
+    return docs
+
+
+def make_questions(n_questions: int) -> list[str]:
+    rng = random.Random(1)
+    templates = ['Why was {topic} {event}?', 'What happened to {topic}?', 'How was {topic} {event} and why?']
+
+    questions = []
+    for _ in range(n_questions):
+        topic, event, _detail = rng.choice(TOPICS)
+        questions.append(rng.choice(templates).format(topic=topic, event=event))
+
+    return questions
+
+
+def install_stand_ins(n_docs: int):
+    """
+        Replaces the services by their stand-ins, seeds the in-memory vector store
+        and returns the graph module. The patches must be in place before the
+        modules creating the models and clients at import time are loaded.
+    """
+    data_dir = tempfile.mkdtemp(prefix='offline_benchmark_')
+    os.environ.setdefault('OPENAI_API_KEY', 'offline')
+    os.environ.setdefault('CHECKPOINT_BACKEND', 'memory')
+    os.environ.setdefault('SEMANTIC_CACHE_ENABLED', 'false')
+    os.environ.setdefault('RETRIEVAL_CACHE_TTL', '0')
+    os.environ['VECTOR_BACKEND'] = 'memory'
+    os.environ['EMBEDDING_CACHE_PATH'] = str(Path(data_dir) / 'embedding_cache.sqlite')
+    os.environ['CORPUS_VERSION_PATH'] = str(Path(data_dir) / 'corpus_version')
+
+    import langchain_openai
+
+    langchain_openai.ChatOpenAI = FakeChatModel
+    langchain_openai.OpenAIEmbeddings = FakeEmbeddings
+
+    from langchain_community.vectorstores import Qdrant
+    import src.vector as vector
+    from src.vector_backend import create_collection
+
+    vector.get_reranker = lambda top_n=3: OverlapReranker(top_n=top_n)
+    create_collection(vector.qdrant_client, vector.DEFAULT_COLLECTION, EMBEDDING_SIZE)
+    vectorstore = Qdrant(
+        client=vector.qdrant_client,
+        collection_name=vector.DEFAULT_COLLECTION,
+        embeddings=vector.get_embeddings()
+    )
+    vector.upsert_documents(vectorstore, make_corpus(n_docs))
+
+    import src.nodes as nodes
+    nodes.search_knowledge_graph = fake_search_knowledge_graph
+    nodes.web_search_tool = FakeSearchClient()
+    if BLOCKING:
+        # before src.graph imports them
+        for name in ('generate_query_or_respond', 'grade_documents', 'generate_response', 'rewrite_query', 'web_search'):
+            setattr(nodes, name, blocking_node(getattr(nodes, name)))
+
+    import src.graph as graph
+
+    return graph
+
+
+async def run_request(agent, question: str, node_latencies: dict[str, list[float]]) -> float:
+    """
+        Runs one question on a new thread, the node timings are taken from the
+        start / end events of the tasks in the debug stream
+    """
+    config = {'configurable': {'thread_id': str(uuid.uuid4())}}
+    started_at = {}
+
+    start = time.perf_counter()
+    async for event in agent.astream({'messages': question}, config=config, stream_mode='debug'):
+        payload, timestamp = event['payload'], datetime.fromisoformat(event['timestamp'])
+        if event['type'] == 'task':
+            started_at[payload['id']] = timestamp
+        elif event['type'] == 'task_result' and payload['id'] in started_at:
+            elapsed = (timestamp - started_at.pop(payload['id'])).total_seconds()
+            node_latencies[payload['name']].append(elapsed)
+
+    return time.perf_counter() - start
+
+
+async def run_level(graph, concurrency: int, questions: list[str]) -> dict:
+    agent = await graph.get_agent()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], []
+    node_latencies = defaultdict(list)
+
+    async def bounded(question: str) -> None:
+        async with semaphore:
+            try:
+                latencies.append(await run_request(agent, question, node_latencies))
+            except Exception as e:
+                errors.append(repr(e))
+
+    start = time.perf_counter()
+    await asyncio.gather(*[bounded(question) for question in questions])
+    elapsed = time.perf_counter() - start
+
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': len(latencies) / elapsed,
+        'latency': percentiles(latencies),
+        'nodes': {name: percentiles(values) for name, values in node_latencies.items()},
+        'node_counts': {name: len(values) for name, values in node_latencies.items()},
+    }
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    if len(values) < 2:
+        value = values[0] if values else float('nan')
+        return {'p50': value, 'p95': value, 'p99': value}
+
+    cuts = statistics.quantiles(values, n=100, method='inclusive')
+
+    return {'p50': cuts[49], 'p95': cuts[94], 'p99': cuts[98]}
+
+
+def print_level(result: dict) -> None:
+    latency = result['latency']
+    print(
+        f"\nconcurrency {result['concurrency']}: {result['requests']} requests, {len(result['errors'])} errors, "
+        f"{result['throughput']:.2f} req/s"
+    )
+    print(f"{'':<28} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    print(
+        f"{'end to end':<28} {result['requests']:>6} {latency['p50'] * 1e3:>9.1f} "
+        f"{latency['p95'] * 1e3:>9.1f} {latency['p99'] * 1e3:>9.1f}"
+    )
+    for name, p in sorted(result['nodes'].items(), key=lambda item: -item[1]['p50']):
+        count = result['node_counts'][name]
+        print(f"{name:<28} {count:>6} {p['p50'] * 1e3:>9.1f} {p['p95'] * 1e3:>9.1f} {p['p99'] * 1e3:>9.1f}")
+    for error in sorted(set(result['errors']))[:5]:
+        print(f'  error: {error}')
+
+
+async def main():
+    global IRRELEVANT_RATE, BLOCKING
+
+    parser = argparse.ArgumentParser(description='Offline benchmark of the RAG graph with local stand-ins')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32], help='requests in flight per run')
+    parser.add_argument('--requests', type=int, default=100, help='requests per concurrency level')
+    parser.add_argument('--documents', type=int, default=400, help='chunks in the synthetic corpus')
+    parser.add_argument('--llm-latency', type=float, default=LATENCY['llm'], help='seconds per chat model call')
+    parser.add_argument('--embedding-latency', type=float, default=LATENCY['embedding'], help='seconds per embedding call')
+    parser.add_argument('--kg-latency', type=float, default=LATENCY['kg'], help='seconds per knowledge graph search')
+    parser.add_argument('--search-latency', type=float, default=LATENCY['search'], help='seconds per web search')
+    parser.add_argument('--jitter', type=float, default=LATENCY['jitter'], help='latencies vary by +- this fraction')
+    parser.add_argument('--irrelevant-rate', type=float, default=IRRELEVANT_RATE, help='fraction of documents graded irrelevant')
+    parser.add_argument('--blocking-nodes', action='store_true', help='run the nodes with blocking service calls, as before they were async')
+    args = parser.parse_args()
+
+    LATENCY.update(
+        llm=args.llm_latency, embedding=args.embedding_latency, kg=args.kg_latency,
+        search=args.search_latency, jitter=args.jitter
+    )
+    IRRELEVANT_RATE = args.irrelevant_rate
+    BLOCKING = args.blocking_nodes
+
+    graph = install_stand_ins(args.documents)
+    questions = make_questions(args.requests)
+
+    async with graph.checkpoints:
+        # warm-up request, so the first level does not pay the one-time setup
+        await run_level(graph, 1, questions[:1])
+
+        for concurrency in args.concurrency:
+            result = await run_level(graph, concurrency, questions)
+            print_level(result)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
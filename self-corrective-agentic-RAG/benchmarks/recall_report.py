@@ -0,0 +1,56 @@
+"""
+    Recall@k report of the quantized vector search of a collection.
+
+    The exact (full-precision) nearest neighbours of sampled stored chunks are compared
+    with the ones found with the quantized vectors, with and without rescoring, and
+    the vector memory of each quantization is estimated from the collection size.
+
+    Usage:
+        python benchmarks/recall_report.py --k 1 3 7 10 --queries 200
+        python benchmarks/recall_report.py --quantize scalar     # quantize the collection first
+
+    It runs against the collection of the configured VECTOR_BACKEND. Only the Qdrant
+    server applies quantization, the embedded backends always report a recall of 1.
+"""
+import sys
+import argparse
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from src.vector import DEFAULT_COLLECTION, qdrant_client
+from src.vector_backend import VECTOR_RESCORE_OVERSAMPLING, quantize_collection, recall_report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recall@k of the quantized vector search')
+    parser.add_argument('--collection', type=str, default=DEFAULT_COLLECTION, help='collection to measure')
+    parser.add_argument('--k', type=int, nargs='+', default=[1, 3, 7, 10], help='cut-offs of the recall')
+    parser.add_argument('--queries', type=int, default=100, help='sampled chunks used as queries')
+    parser.add_argument('--oversampling', type=float, default=VECTOR_RESCORE_OVERSAMPLING, help='rescoring oversampling')
+    parser.add_argument(
+        '--quantize', choices=['none', 'scalar', 'binary', 'product'], help='quantization applied to the collection first'
+    )
+    args = parser.parse_args()
+
+    if args.quantize:
+        quantize_collection(qdrant_client, args.collection, quantization=args.quantize)
+
+    report = recall_report(
+        qdrant_client, args.collection, k_values=tuple(args.k), n_queries=args.queries, oversampling=args.oversampling
+    )
+
+    print(f"Collection {args.collection}: {report['points']} points of {report['vector_size']} dimensions, "
+          f"quantization {report['quantization']}\n")
+    print('Estimated vector memory:')
+    for quantization, megabytes in report['memory_mb'].items():
+        print(f'  {quantization:<8} {megabytes:10.1f} MB')
+
+    print(f"\n{'search':<22} {'ms/query':>9} " + ' '.join(f'{"recall@" + str(k):>10}' for k in args.k))
+    print(f"{'exact':<22} {report['latency_ms']['exact']:>9.2f}")
+    for mode, recall in report['recall'].items():
+        print(f"{mode:<22} {report['latency_ms'][mode]:>9.2f} " + ' '.join(f'{recall[k]:>10.3f}' for k in args.k))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+    Microbenchmark of the parsing cost of a Brave web search response (20 results),
+    from the raw HTTP body to the results used by the agents:
+
+        - langchain tool + ast.literal_eval: the BraveSearch tool json-dumps the
+          results to a string, which the nodes parsed back with ast.literal_eval
+        - json dicts: json.loads of the body and a dict per result
+        - SearchResult: pydantic validation of the body into typed results
+          (common.brave_search.parse_results)
+
+    The results are compared with the ones of the langchain tool, whose request asked
+    for extra snippets: the search client sends its request to a mock API, which (like
+    the Brave API) only returns extra snippets when they are requested.
+
+    Usage:
+        python benchmarks/search_parse_benchmark.py --results 20 --repeat 2000
+"""
+import sys
+import ast
+import json
+import argparse
+import timeit
+from pathlib import Path
+
+import httpx
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+
+from common.brave_search import HTML_TAGS, BraveSearchClient, parse_results
+
+
+QUERY = 'apple intelligence delays'
+
+
+def baseline_params(n_results: int) -> dict:
+    # request of the langchain BraveSearch tool (BraveSearchWrapper)
+    return {'q': QUERY, 'count': str(n_results), 'extra_snippets': 'true'}
+
+
+def make_payload(n_results: int, extra_snippets: bool = True) -> bytes:
+    """
+        Brave-like response body, with the metadata fields the API returns around each result
+    """
+    results = [
+        {
+            'type': 'search_result',
+            'subtype': 'generic',
+            'title': f'Apple Intelligence delays, part {i} – <strong>Bloomberg</strong>',
+            'url': f'https://www.example.com/news/apple-intelligence-{i}',
+            'is_source_local': False,
+            'is_source_both': False,
+            'description': (
+                f'Apple’s <strong>AI</strong> push stumbled as Siri features slipped to {2025 + i % 3}. '
+                'Executives reshuffled the team and the company weighed acquisitions to catch up. ' * 2
+            ),
+            'page_age': '2025-03-14T12:00:00',
+            'profile': {
+                'name': 'Example News',
+                'url': 'https://www.example.com',
+                'long_name': 'example.com',
+                'img': 'https://imgs.search.brave.com/icon.png',
+            },
+            'language': 'en',
+            'family_friendly': True,
+            'meta_url': {
+                'scheme': 'https',
+                'netloc': 'example.com',
+                'hostname': 'www.example.com',
+                'favicon': 'https://imgs.search.brave.com/favicon.png',
+                'path': f'› news › apple-intelligence-{i}',
+            },
+            'thumbnail': {'src': 'https://imgs.search.brave.com/thumb.jpg', 'original': None, 'logo': False},
+            'age': 'March 14, 2025',
+            'extra_snippets': [f'Extra snippet {j} about the Siri redesign and leadership changes.' for j in range(3)],
+        }
+        for i in range(n_results)
+    ]
+    if not extra_snippets:
+        for result in results:
+            del result['extra_snippets']
+    payload = {
+        'query': {'original': 'apple intelligence delays', 'more_results_available': True},
+        'mixed': {'type': 'mixed', 'main': [{'type': 'web', 'index': i, 'all': False} for i in range(n_results)]},
+        'type': 'search',
+        'web': {'type': 'search', 'results': results, 'family_friendly': True},
+    }
+
+    return json.dumps(payload).encode()
+
+
+def parse_as_dicts(content: bytes) -> list[dict]:
+    return [
+        {
+            'title': HTML_TAGS.sub('', result.get('title') or ''),
+            'link': result.get('url') or '',
+            'snippet': HTML_TAGS.sub('', ' '.join(
+                filter(None, [result.get('description'), *(result.get('extra_snippets') or [])])
+            )),
+        }
+        for result in json.loads(content).get('web', {}).get('results', [])
+    ]
+
+
+def parse_with_literal_eval(content: bytes) -> list[dict]:
+    # string produced by the langchain BraveSearch tool, then parsed by the nodes
+    tool_output = json.dumps(parse_as_dicts(content))
+
+    return ast.literal_eval(tool_output)
+
+
+def search_with_client(n_results: int) -> tuple[dict, list[dict]]:
+    """
+        Searches through BraveSearchClient against a mock API, returns the request
+        parameters it sent and its results
+    """
+    requests = []
+
+    def mock_api(request: httpx.Request) -> httpx.Response:
+        params = dict(request.url.params)
+        requests.append(params)
+        return httpx.Response(200, content=make_payload(n_results, extra_snippets=params.get('extra_snippets') == 'true'))
+
+    client = BraveSearchClient(api_key='benchmark', cache_ttl=0)
+    client._client = httpx.Client(transport=httpx.MockTransport(mock_api))
+    results = client.search(QUERY, count=n_results)
+
+    return requests[0], [result.model_dump() for result in results]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Search result parsing microbenchmark')
+    parser.add_argument('--results', type=int, default=20, help='results in the response')
+    parser.add_argument('--repeat', type=int, default=2000, help='parses per measurement')
+    args = parser.parse_args()
+
+    content = make_payload(args.results)
+    print(f'Response body of {len(content)} bytes with {args.results} results\n')
+
+    params, client_results = search_with_client(args.results)
+    print(f'Request parameters same as the langchain tool: {params == baseline_params(args.results)} {params}')
+    print(f'Search client results same as the langchain tool: {client_results == parse_as_dicts(content)}\n')
+
+    candidates = {
+        'langchain tool + ast.literal_eval': parse_with_literal_eval,
+        'json dicts': parse_as_dicts,
+        'SearchResult': parse_results,
+    }
+    expected = parse_as_dicts(content)
+    for name, parse in candidates.items():
+        parsed = parse(content)
+        same = [r if isinstance(r, dict) else r.model_dump() for r in parsed] == expected
+        elapsed = min(timeit.repeat(lambda: parse(content), number=args.repeat, repeat=5)) / args.repeat
+        print(f'{name:<36} {elapsed * 1e6:9.1f} us per response   same results {same}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+    Compares the checkpoint write/read cost of the typed MessageSerializer against
+    the `_msgpack_enc` monkey patch it replaced and the stock JsonPlusSerializer.
+
+    Each serializer dumps and loads a checkpoint shaped like the agent state after a
+    few RAG turns (messages with tool calls + retrieved documents).
+
+    Usage:
+        python benchmarks/serde_benchmark.py --turns 10 --repeat 200
+"""
+import sys
+import argparse
+import timeit
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.serde import jsonplus
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer, _msgpack_default, _option, ormsgpack
+
+from common.checkpointer import CompressedSerializer
+from common.serde import MessageSerializer
+
+
+def legacy_message_to_dict(msg):
+    # conversion previously applied by src/workarounds.py
+    if hasattr(msg, 'to_dict'):
+        return msg.to_dict()
+    elif isinstance(msg, dict):
+        return msg
+    else:
+        return {'role': getattr(msg, 'role', 'user'), 'content': str(getattr(msg, 'content', msg))}
+
+
+def legacy_msgpack_enc(data: Any) -> bytes:
+    return ormsgpack.packb(legacy_message_to_dict(data), default=_msgpack_default, option=_option)
+
+
+@contextmanager
+def legacy_patch():
+    original = jsonplus._msgpack_enc
+    jsonplus._msgpack_enc = legacy_msgpack_enc
+    try:
+        yield
+    finally:
+        jsonplus._msgpack_enc = original
+
+
+def make_state(turns: int) -> dict:
+    messages, documents = [], []
+    for turn in range(turns):
+        tool_call_id = f'call_{turn}'
+        documents = [
+            Document(
+                page_content=f'Retrieved passage {turn}-{i}. ' * 40,
+                metadata={'source': 'data.pdf', 'page': i, 'relevance_score': 0.9 - i / 10},
+                id=f'{turn}-{i}'
+            )
+            for i in range(5)
+        ]
+        messages += [
+            HumanMessage(content=f'What does the report say about topic {turn}?', id=f'h{turn}'),
+            AIMessage(
+                content='',
+                id=f'a{turn}',
+                tool_calls=[{'name': 'retrieve_from_all_sources', 'args': {}, 'id': tool_call_id}]
+            ),
+            ToolMessage(content='Updated the documents key', tool_call_id=tool_call_id, id=f't{turn}'),
+            AIMessage(content=f'Answer to question {turn}. ' * 30, id=f'r{turn}'),
+        ]
+
+    return {
+        'messages': messages,
+        'user_question': f'What does the report say about topic {turns - 1}?',
+        'documents_vs': documents,
+        'documents_kg': [f'Node Name: entity {i}\nContent Summary: summary' for i in range(5)],
+        'documents': documents,
+    }
+
+
+def bench(name: str, serde, state: dict, repeat: int) -> None:
+    typed = serde.dumps_typed(state)
+    write = timeit.timeit(lambda: serde.dumps_typed(state), number=repeat) / repeat
+
+    try:
+        lossless = serde.loads_typed(typed) == state
+        read = f'{timeit.timeit(lambda: serde.loads_typed(typed), number=repeat) / repeat * 1e6:9.1f} us'
+    except Exception as e:
+        # the legacy patch stringifies nested payloads, which then fail to decode
+        lossless, read = False, f'failed ({type(e).__name__})'
+
+    print(
+        f'{name:<28} write {write * 1e6:9.1f} us   read {read:>12}   '
+        f'size {len(typed[1]):8d} B   lossless {lossless}'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Checkpoint serializer benchmark')
+    parser.add_argument('--turns', type=int, default=10, help='conversation turns in the checkpoint')
+    parser.add_argument('--repeat', type=int, default=200, help='dumps/loads calls per measurement')
+    args = parser.parse_args()
+
+    state = make_state(args.turns)
+    print(f'Checkpoint with {len(state["messages"])} messages and {len(state["documents"])} documents\n')
+
+    with legacy_patch():
+        bench('workarounds.monkey_patch', JsonPlusSerializer(), state, args.repeat)
+    bench('JsonPlusSerializer', JsonPlusSerializer(), state, args.repeat)
+    bench('MessageSerializer', MessageSerializer(), state, args.repeat)
+    bench('MessageSerializer + zlib', CompressedSerializer(MessageSerializer()), state, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterator, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.stores import ByteStore
+
+
+CORPUS_VERSION_PATH = Path(
+    os.environ.get('CORPUS_VERSION_PATH', Path(__file__).resolve().parents[1] / 'data' / 'corpus_version')
+)
+
+
+def get_corpus_version() -> int:
+    """
+        Version of the indexed corpus (vector store + knowledge graph). It is kept in a
+        file so that ingestion scripts invalidate caches of running app processes.
+    """
+    try:
+        return int(CORPUS_VERSION_PATH.read_text())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def bump_corpus_version() -> int:
+    """
+        Marks the corpus as changed, invalidating every cache built on the previous version
+    """
+    version = get_corpus_version() + 1
+    CORPUS_VERSION_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = CORPUS_VERSION_PATH.with_suffix('.tmp')
+    tmp_path.write_text(str(version))
+    os.replace(tmp_path, CORPUS_VERSION_PATH)
+    
+    return version
+
+
+class SQLiteLRUByteStore(ByteStore):
+    """
+        Disk-backed key/value store in a local SQLite file. Once the store holds
+        more than `max_entries` keys, the least recently used ones are evicted.
+    """
+    def __init__(self, path: str | Path, max_entries: int = 50_000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, last_access REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)')
+        self._conn.commit()
+
+
+    def mget(self, keys: Sequence[str]) -> list[Optional[bytes]]:
+        if not keys:
+            return []
+
+        placeholders = ','.join('?' * len(keys))
+        with self._lock:
+            rows = dict(
+                self._conn.execute(f'SELECT key, value FROM entries WHERE key IN ({placeholders})', list(keys))
+            )
+            if rows:
+                now = time.time()
+                self._conn.executemany(
+                    'UPDATE entries SET last_access = ? WHERE key = ?', [(now, key) for key in rows]
+                )
+                self._conn.commit()
+
+        return [rows.get(key) for key in keys]
+
+
+    def mset(self, key_value_pairs: Sequence[tuple[str, bytes]]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO entries (key, value, last_access) VALUES (?, ?, ?)',
+                [(key, value, now) for key, value in key_value_pairs]
+            )
+            self._evict()
+            self._conn.commit()
+
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        with self._lock:
+            self._conn.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key in keys])
+            self._conn.commit()
+
+
+    def yield_keys(self, *, prefix: Optional[str] = None) -> Iterator[str]:
+        with self._lock:
+            if prefix:
+                rows = self._conn.execute('SELECT key FROM entries WHERE key LIKE ?', (f'{prefix}%',)).fetchall()
+            else:
+                rows = self._conn.execute('SELECT key FROM entries').fetchall()
+
+        for (key,) in rows:
+            yield key
+
+
+    def _evict(self) -> None:
+        (count,) = self._conn.execute('SELECT COUNT(*) FROM entries').fetchone()
+        if count > self.max_entries:
+            self._conn.execute(
+                'DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_access LIMIT ?)',
+                (count - self.max_entries,)
+            )
+
+
+class SemanticCache:
+    """
+        In-memory cache of answers keyed by question embedding. A question is a hit
+        when a stored question has a cosine similarity of at least `threshold`, the
+        entry is younger than `ttl` seconds and was stored for the current corpus version.
+    """
+    def __init__(
+            self,
+            embeddings: Embeddings,
+            threshold: float = 0.95,
+            ttl: float = 3600,
+            max_entries: int = 1000
+        ):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        self._entries: list[tuple[str, str, float, int]] = []   # (question, answer, created_at, corpus_version)
+        self._query_vectors: OrderedDict[str, np.ndarray] = OrderedDict()
+
+
+    def _normalize(self, vector: list[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        
+        return vector / (np.linalg.norm(vector) or 1.0)
+    
+    
+    def _remember(self, question: str, vector: list[float]) -> np.ndarray:
+        # the question embedded on lookup is embedded again on update, keep the latest ones
+        vector = self._normalize(vector)
+        with self._lock:
+            self._query_vectors[question] = vector
+            while len(self._query_vectors) > 256:
+                self._query_vectors.popitem(last=False)
+        
+        return vector
+
+
+    def _purge(self) -> None:
+        now = time.time()
+        version = get_corpus_version()
+        keep = [
+            i for i, (_, _, created_at, corpus_version) in enumerate(self._entries)
+            if now - created_at < self.ttl and corpus_version == version
+        ][-self.max_entries:]
+        
+        if len(keep) != len(self._entries):
+            self._entries = [self._entries[i] for i in keep]
+            self._vectors = self._vectors[keep] if keep else np.empty((0, 0), dtype=np.float32)
+
+
+    def _lookup(self, vector: np.ndarray) -> Optional[str]:
+        with self._lock:
+            self._purge()
+            if not self._entries:
+                return None
+            
+            similarities = self._vectors @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                return self._entries[best][1]
+        
+        return None
+
+
+    def _store(self, question: str, answer: str, vector: np.ndarray) -> None:
+        with self._lock:
+            self._entries.append((question, answer, time.time(), get_corpus_version()))
+            self._vectors = vector[None, :] if not self._vectors.size else np.vstack([self._vectors, vector])
+            self._purge()
+
+
+    def lookup(self, question: str) -> Optional[str]:
+        vector = self._query_vectors.get(question)
+        if vector is None:
+            vector = self._remember(question, self.embeddings.embed_query(question))
+        
+        return self._lookup(vector)
+
+
+    async def alookup(self, question: str) -> Optional[str]:
+        vector = self._query_vectors.get(question)
+        if vector is None:
+            vector = self._remember(question, await self.embeddings.aembed_query(question))
+        
+        return self._lookup(vector)
+
+
+    def update(self, question: str, answer: str) -> None:
+        vector = self._query_vectors.get(question)
+        if vector is None:
+            vector = self._remember(question, self.embeddings.embed_query(question))
+        
+        self._store(question, answer, vector)
+
+
+    async def aupdate(self, question: str, answer: str) -> None:
+        vector = self._query_vectors.get(question)
+        if vector is None:
+            vector = self._remember(question, await self.embeddings.aembed_query(question))
+        
+        self._store(question, answer, vector)
@@ -0,0 +1,166 @@
+import os
+from itertools import combinations
+from typing import Optional, Union
+
+from langchain.schema import Document
+
+from src.history import get_encoding
+
+
+CONTEXT_MAX_TOKENS = int(os.environ.get('CONTEXT_MAX_TOKENS', 3000))
+CONTEXT_DEDUP_THRESHOLD = float(os.environ.get('CONTEXT_DEDUP_THRESHOLD', 0.8))
+
+SHINGLE_SIZE = 5
+MIN_OVERLAP_CHARS = 40
+
+
+def to_document(doc: Union[Document, str]) -> Document:
+    # knowledge graph results are plain strings
+    return doc if isinstance(doc, Document) else Document(page_content=doc)
+
+
+def merge_overlapping(first: str, second: str) -> Optional[str]:
+    """
+        Merges two chunks when the start of `second` repeats the end of `first`
+        (the splitter overlap), returns None when they do not overlap
+    """
+    head = second[:MIN_OVERLAP_CHARS]
+    if len(head) < MIN_OVERLAP_CHARS:
+        return None
+
+    start = first.find(head)
+    while start != -1:
+        if second.startswith(first[start:]):
+            return first[:start] + second
+        start = first.find(head, start + 1)
+
+    return None
+
+
+def merge_documents(first: Document, second: Document) -> Optional[Document]:
+    """
+        Merges two overlapping chunks, in either order, into one taking the best
+        relevance score of both. Returns None when they do not overlap.
+    """
+    text = merge_overlapping(first.page_content, second.page_content) or merge_overlapping(
+        second.page_content, first.page_content
+    )
+    if text is None:
+        return None
+
+    metadata = {**first.metadata}
+    scores = [d.metadata['relevance_score'] for d in (first, second) if 'relevance_score' in d.metadata]
+    if scores:
+        metadata['relevance_score'] = max(scores)
+    starts = [d.metadata['start_index'] for d in (first, second) if 'start_index' in d.metadata]
+    if starts:
+        metadata['start_index'] = min(starts)
+
+    return Document(page_content=text, metadata=metadata)
+
+
+def merge_adjacent_chunks(docs: list[Document]) -> list[Document]:
+    """
+        Merges runs of overlapping chunks of the same page. The chunks of a page are
+        sorted by their position in it (`start_index`, when every chunk has one) and
+        merged until no two of them overlap, so a chunk bridging two others joins
+        them in one. A merged chunk takes the position of its first part in `docs`
+        and the best relevance score of its parts.
+    """
+    parts: list[tuple[int, Document]] = []
+    pages: dict[tuple, list[tuple[int, Document]]] = {}
+    for i, doc in enumerate(docs):
+        if doc.metadata.get('page') is None:
+            parts.append((i, doc))
+        else:
+            pages.setdefault((doc.metadata.get('source'), doc.metadata.get('page')), []).append((i, doc))
+
+    for chunks in pages.values():
+        if all('start_index' in doc.metadata for _, doc in chunks):
+            chunks.sort(key=lambda chunk: chunk[1].metadata['start_index'])
+
+        merging = True
+        while merging:
+            merging = False
+            for a, b in combinations(range(len(chunks)), 2):
+                doc = merge_documents(chunks[a][1], chunks[b][1])
+                if doc is not None:
+                    chunks[a] = (min(chunks[a][0], chunks[b][0]), doc)
+                    del chunks[b]
+                    merging = True
+                    break
+
+        parts.extend(chunks)
+
+    return [doc for _, doc in sorted(parts, key=lambda part: part[0])]
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> set[tuple[str, ...]]:
+    words = text.lower().split()
+    if len(words) <= size:
+        return {tuple(words)}
+
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def remove_near_duplicates(docs: list[Document], threshold: float = CONTEXT_DEDUP_THRESHOLD) -> list[Document]:
+    """
+        Drops documents sharing at least a `threshold` fraction of their word shingles
+        (overlap coefficient) with a document kept before them, so a short summary
+        contained in a longer one is dropped too
+    """
+    kept, kept_shingles = [], []
+    for doc in docs:
+        doc_shingles = shingles(doc.page_content)
+        is_duplicate = any(
+            len(doc_shingles & other) / min(len(doc_shingles), len(other)) >= threshold
+            for other in kept_shingles
+        )
+        if not is_duplicate:
+            kept.append(doc)
+            kept_shingles.append(doc_shingles)
+
+    return kept
+
+
+def order_by_relevance(docs: list[Document]) -> list[Document]:
+    """
+        Reranked vector store chunks first, by relevance score, then the other
+        documents (knowledge graph, web results) in their original order
+    """
+    scored = [doc for doc in docs if 'relevance_score' in doc.metadata]
+    unscored = [doc for doc in docs if 'relevance_score' not in doc.metadata]
+
+    return sorted(scored, key=lambda doc: doc.metadata['relevance_score'], reverse=True) + unscored
+
+
+def pack_context(
+        documents: list[Union[Document, str]],
+        max_tokens: int = CONTEXT_MAX_TOKENS,
+        dedup_threshold: float = CONTEXT_DEDUP_THRESHOLD
+    ) -> str:
+    """
+        Assembles the context passed to the answer generation: overlapping chunks of
+        the same page are merged, near-duplicates removed, documents ordered by
+        relevance and added while they fit in `max_tokens`.
+
+        Args:
+            documents (list): Graded documents (vector store chunks, knowledge graph summaries, web results)
+            max_tokens (int): Token budget of the context
+
+        Returns:
+            str: Context, one document per paragraph
+    """
+    docs = [doc for doc in map(to_document, documents) if doc.page_content.strip()]
+    docs = order_by_relevance(remove_near_duplicates(merge_adjacent_chunks(docs), dedup_threshold))
+
+    encoding = get_encoding()
+    context, n_tokens = [], 0
+    for doc in docs:
+        doc_tokens = len(encoding.encode(doc.page_content))
+        if n_tokens + doc_tokens > max_tokens:
+            continue
+        context.append(doc.page_content)
+        n_tokens += doc_tokens
+
+    return '\n\n'.join(context)
@@ -1,32 +1,52 @@
 import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parents[1]))
+sys.path.append(str(Path(__file__).resolve().parents[2]))
 
-from src import workarounds
-workarounds.monkey_patch()
+from typing import AsyncIterator
 
+from loguru import logger as log
+from langchain_core.messages import AIMessageChunk
 from langgraph.graph import END, StateGraph
 from langgraph.prebuilt import tools_condition
 from langgraph.prebuilt import ToolNode
-from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.graph.state import CompiledStateGraph
 
 from src.nodes import (
     AgentState, retrieve_from_all_sources, generate_query_or_respond, grade_documents,
     generate_response, rewrite_query, web_search, decide_to_generate,
+    respond_from_cache, decide_to_grade,
 )
+from src.vector import warm_up_retrievers
+from src.knowledge_graph import graphiti_pool
+from src.history import SUMMARY_TAG
+from common.checkpointer import AsyncCheckpointManager
+from common.instrumentation import instrument_graph, instrument_node
+
+# conversation threads, persisted in data/checkpoints.sqlite unless CHECKPOINT_BACKEND says otherwise
+checkpoints = AsyncCheckpointManager(
+    default_sqlite_path=str(Path(__file__).resolve().parents[1] / 'data' / 'checkpoints.sqlite')
+)
+_agent: CompiledStateGraph | None = None
 
-memory = InMemorySaver()
+# nodes whose LLM tokens are part of the answer shown to the user
+ANSWER_NODES = {'generate_query_or_respond', 'generate_response'}
 
 
-def build_agent():
+def build_agent(checkpointer: BaseCheckpointSaver):
     graph = StateGraph(AgentState)
 
-    graph.add_node(generate_query_or_respond)
-    graph.add_node('retrieve_from_all_sources', ToolNode(tools=[retrieve_from_all_sources]))
-    graph.add_node('grade_documents', grade_documents)
-    graph.add_node('generate_response', generate_response)
-    graph.add_node('transform_query', rewrite_query)
-    graph.add_node('web_search', web_search)
+    graph.add_node(instrument_node(generate_query_or_respond))
+    graph.add_node(
+        'retrieve_from_all_sources',
+        instrument_node(ToolNode(tools=[retrieve_from_all_sources]), 'retrieve_from_all_sources')
+    )
+    graph.add_node('grade_documents', instrument_node(grade_documents))
+    graph.add_node('generate_response', instrument_node(generate_response))
+    graph.add_node('transform_query', instrument_node(rewrite_query, 'transform_query'))
+    graph.add_node('web_search', instrument_node(web_search))
+    graph.add_node('respond_from_cache', instrument_node(respond_from_cache))
 
     graph.set_entry_point('generate_query_or_respond')
 
@@ -39,7 +59,14 @@ def build_agent():
         }
     )
 
-    graph.add_edge('retrieve_from_all_sources', 'grade_documents')
+    graph.add_conditional_edges(
+        source='retrieve_from_all_sources',
+        path=decide_to_grade,
+        path_map={
+            'respond_from_cache': 'respond_from_cache',
+            'grade_documents': 'grade_documents'
+        }
+    )
     graph.add_conditional_edges(
         source='grade_documents',
         path=decide_to_generate,
@@ -52,19 +79,67 @@ def build_agent():
     graph.add_edge('transform_query', 'web_search')
     graph.add_edge('web_search', 'generate_response')
     graph.add_edge('generate_response', END)
+    graph.add_edge('respond_from_cache', END)
 
-    agent = graph.compile(checkpointer=memory)
+    agent = instrument_graph(graph.compile(checkpointer=checkpointer))
     
     return agent
 
 
-agent = build_agent()
+async def get_agent() -> CompiledStateGraph:
+    """
+        Returns the agent compiled with the checkpointer of the running event loop
+    """
+    global _agent
+    
+    checkpointer = await checkpoints.asetup()
+    if _agent is None or _agent.checkpointer is not checkpointer:
+        _agent = build_agent(checkpointer)
+    
+    return _agent
+
+
+async def startup() -> bool:
+    """
+        Opens the checkpointer and the first knowledge graph client ahead of the first
+        request. The agent still answers from the other sources without the knowledge graph.
+
+        Returns:
+            bool: Whether the knowledge graph (Neo4j) is reachable
+    """
+    await get_agent()
+    try:
+        await graphiti_pool.startup()
+    except ConnectionError as e:
+        log.warning(f'{e}, answering without it until it is reachable')
+        return False
+    
+    return True
+
+
+async def health_check() -> bool:
+    """
+        Returns True if the knowledge graph (Neo4j) is reachable
+    """
+    return await graphiti_pool.health_check()
+
+
+async def shutdown() -> None:
+    """
+        Closes the knowledge graph clients and the checkpointer connection
+    """
+    await graphiti_pool.shutdown()
+    await checkpoints.aclose()
+
+
+warm_up_retrievers()
 
 async def interact_with_agent(
     query: str,
     thread_id: str,
-    agent = agent
+    agent = None
 ):
+    agent = agent or await get_agent()
     config = {'configurable': {'thread_id': thread_id}}
 
     # Include history in the agent's input
@@ -74,6 +149,45 @@ async def interact_with_agent(
         },
         config=config
     )    
+    await checkpoints.aafter_turn(thread_id)
     
     return response['messages'][-1].content
-    
\ No newline at end of file
+
+
+async def stream_agent(
+    query: str,
+    thread_id: str,
+    agent = None
+) -> AsyncIterator[dict]:
+    """
+        Runs the agent and streams its progress. Yields `{'type': 'node', 'name': ...}`
+        when a node finishes, `{'type': 'token', 'content': ...}` for every answer token
+        and a final `{'type': 'answer', 'content': ...}` with the complete answer.
+    """
+    agent = agent or await get_agent()
+    config = {'configurable': {'thread_id': thread_id}}
+
+    async for mode, chunk in agent.astream(
+        {
+            'messages': query,
+        },
+        config=config,
+        stream_mode=['messages', 'updates']
+    ):
+        if mode == 'messages':
+            message, metadata = chunk
+            if (
+                isinstance(message, AIMessageChunk)
+                and message.content
+                and metadata.get('langgraph_node') in ANSWER_NODES
+                and SUMMARY_TAG not in metadata.get('tags', [])
+            ):
+                yield {'type': 'token', 'content': message.content}
+        
+        else:
+            for node in chunk:
+                yield {'type': 'node', 'name': node}
+    
+    state = await agent.aget_state(config)
+    await checkpoints.aafter_turn(thread_id)
+    yield {'type': 'answer', 'content': state.values['messages'][-1].content}
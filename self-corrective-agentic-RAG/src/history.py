@@ -0,0 +1,111 @@
+import os
+import json
+from functools import lru_cache
+from typing import Iterable, Optional
+
+import tiktoken
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, ToolMessage, convert_to_messages
+from langmem.short_term import RunningSummary, asummarize_messages
+
+
+HISTORY_MODEL = os.environ.get('HISTORY_MODEL', 'gpt-4o-mini')
+HISTORY_MAX_TOKENS = int(os.environ.get('HISTORY_MAX_TOKENS', 2000))
+HISTORY_MAX_SUMMARY_TOKENS = int(os.environ.get('HISTORY_MAX_SUMMARY_TOKENS', 256))
+
+# langmem needs room for the recent messages next to the summary
+if HISTORY_MAX_TOKENS <= HISTORY_MAX_SUMMARY_TOKENS:
+    raise ValueError(
+        f'HISTORY_MAX_TOKENS ({HISTORY_MAX_TOKENS}) must be greater than '
+        f'HISTORY_MAX_SUMMARY_TOKENS ({HISTORY_MAX_SUMMARY_TOKENS})'
+    )
+
+# tag of the summarization LLM calls, their tokens are not part of the answer
+SUMMARY_TAG = 'history_summary'
+
+# tokens added by the chat format around every message
+TOKENS_PER_MESSAGE = 3
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = HISTORY_MODEL) -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding('o200k_base')
+
+
+def count_tokens(messages: Iterable) -> int:
+    """
+        Approximates the number of prompt tokens of `messages` with the tiktoken
+        encoding of the chat model, including tool call arguments
+    """
+    encoding = get_encoding()
+    n_tokens = 0
+    for message in convert_to_messages(messages):
+        content = message.content if isinstance(message.content, str) else json.dumps(message.content)
+        n_tokens += TOKENS_PER_MESSAGE + len(encoding.encode(content))
+        for tool_call in getattr(message, 'tool_calls', None) or []:
+            n_tokens += len(encoding.encode(tool_call['name'] + json.dumps(tool_call['args'])))
+
+    return n_tokens
+
+
+def trim_tool_messages(messages: list[AnyMessage]) -> list[AnyMessage]:
+    """
+        Drops the tool calls of previous turns (the AI message requesting the
+        retrieval and its tool result). They only tell the agent that documents
+        were retrieved, the answer that followed is kept. An AI message with both
+        text and tool calls keeps its text, without the calls, since a tool call
+        without its result is rejected by the API. Tool calls of the current turn,
+        after the last human message, are kept.
+    """
+    last_human = max((i for i, message in enumerate(messages) if isinstance(message, HumanMessage)), default=0)
+
+    trimmed = []
+    for i, message in enumerate(messages):
+        if i < last_human and isinstance(message, ToolMessage):
+            continue
+        if i < last_human and isinstance(message, AIMessage) and (message.tool_calls or message.invalid_tool_calls):
+            if not message.content:
+                continue
+            additional_kwargs = {key: value for key, value in message.additional_kwargs.items() if key != 'tool_calls'}
+            message = message.model_copy(
+                update={'tool_calls': [], 'invalid_tool_calls': [], 'additional_kwargs': additional_kwargs}
+            )
+        trimmed.append(message)
+
+    return trimmed
+
+
+async def window_history(
+        messages: list[AnyMessage],
+        running_summary: Optional[RunningSummary],
+        model: BaseChatModel,
+        max_tokens: int = HISTORY_MAX_TOKENS,
+        max_summary_tokens: int = HISTORY_MAX_SUMMARY_TOKENS,
+    ) -> tuple[list[AnyMessage], Optional[RunningSummary]]:
+    """
+        Fits the conversation history into a token budget. Once the history exceeds
+        `max_tokens`, the oldest turns are folded into a running summary, which is
+        extended incrementally on later turns instead of re-summarizing everything.
+        The summarization calls are tagged SUMMARY_TAG, so they are not streamed as answer tokens.
+
+        Args:
+            messages (list): Full conversation history
+            running_summary (RunningSummary): Summary of the previous turns, if any
+            model (BaseChatModel): Model used to write the summary
+
+        Returns:
+            tuple: Messages to send to the LLM and the updated running summary
+    """
+    result = await asummarize_messages(
+        messages,
+        running_summary=running_summary,
+        model=model.bind(max_tokens=max_summary_tokens).with_config(tags=[SUMMARY_TAG]),
+        max_tokens=max_tokens,
+        max_summary_tokens=max_summary_tokens,
+        token_counter=count_tokens,
+    )
+
+    return trim_tool_messages(result.messages), result.running_summary
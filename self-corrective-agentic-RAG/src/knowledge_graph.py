@@ -1,7 +1,12 @@
 import sys
 import os
+import json
+import time
 import asyncio
+import hashlib
+import uuid
 
+from contextlib import asynccontextmanager
 from pathlib import Path
 from datetime import datetime, timezone
 
@@ -11,16 +16,34 @@ sys.path.append(str(Path(__file__).resolve().parents[2]))
 from dotenv import load_dotenv
 from loguru import logger as log
 from tqdm import tqdm
+from tenacity import AsyncRetrying, stop_after_attempt, wait_exponential
 
+from neo4j.exceptions import ServiceUnavailable, SessionExpired
 from graphiti_core import Graphiti
 from graphiti_core.nodes import EpisodeType
 from graphiti_core.search.search_config_recipes import NODE_HYBRID_SEARCH_RRF
+from graphiti_core.utils.bulk_utils import RawEpisode
 
-from src.vector import prepare_data
+from src.vector import prepare_data, RETRIEVAL_CACHE_TTL, RETRIEVAL_CACHE_MAX_ENTRIES
+from src.cache import bump_corpus_version, get_corpus_version
+from common.cache import TTLCache, normalize_query
+from common.instrumentation import record_cache_hit
 from utils.config import ENV_FILE_PATH
 
 load_dotenv(ENV_FILE_PATH)
 
+GRAPHITI_POOL_SIZE = int(os.environ.get('GRAPHITI_POOL_SIZE', 4))
+GRAPHITI_ACQUIRE_TIMEOUT = float(os.environ.get('GRAPHITI_ACQUIRE_TIMEOUT', 30))
+
+KG_INGESTION_BATCH_SIZE = int(os.environ.get('KG_INGESTION_BATCH_SIZE', 16))
+KG_INGESTION_MAX_RETRIES = int(os.environ.get('KG_INGESTION_MAX_RETRIES', 3))
+KG_CHECKPOINT_PATH = Path(
+    os.environ.get('KG_CHECKPOINT_PATH', Path(__file__).resolve().parents[1] / 'data' / 'kg_ingestion_checkpoint.json')
+)
+
+# knowledge graph search results of recent questions, keyed by normalized question, limit and corpus version
+kg_search_cache = TTLCache(ttl=RETRIEVAL_CACHE_TTL, max_entries=RETRIEVAL_CACHE_MAX_ENTRIES)
+
 
 def create_graphiti_instance():
     neo4j_uri = os.environ.get('NEO4J_URI')
@@ -32,47 +55,263 @@ def create_graphiti_instance():
     return graphiti
 
 
-async def create_knowledge_graph(pdf_files: list[str]) -> None:
-    doc_splits = prepare_data(pdf_files)
-
-    graphiti = create_graphiti_instance()
-    await graphiti.build_indices_and_constraints()
+class GraphitiPool:
+    """
+        Bounded pool of Graphiti clients shared by every knowledge graph query.
+        Each client owns one Neo4j driver, which is reused across requests
+        instead of being opened (and never closed) per question.
+    """
+    def __init__(
+            self,
+            max_size: int = GRAPHITI_POOL_SIZE,
+            acquire_timeout: float = GRAPHITI_ACQUIRE_TIMEOUT
+        ):
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self._idle: list[Graphiti] = []
+        self._semaphore = None
+        self._loop = None
+        
+        
+    async def _bind_loop(self) -> None:
+        """
+            Asyncio primitives and Neo4j async drivers are bound to the event loop
+            that created them, so the pool is reset when the running loop changes
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        
+        stale, self._idle = self._idle, []
+        for graphiti in stale:
+            await self._close(graphiti)
+        
+        self._loop = loop
+        self._semaphore = asyncio.Semaphore(self.max_size)
+        
+        
+    async def _close(self, graphiti: Graphiti) -> None:
+        try:
+            await graphiti.close()
+        except Exception as e:
+            log.warning(f'Failed to close Graphiti client: {e}')
+    
     
-    log.info('Adding episodes to the knowledge graph...')
-    for i, episode in tqdm(enumerate(doc_splits), total=len(doc_splits), desc='Adding episodes'):
+    @asynccontextmanager
+    async def acquire(self):
+        """
+            Borrows a Graphiti client, waiting while all `max_size` clients are in use
+        """
+        await self._bind_loop()
+        await asyncio.wait_for(self._semaphore.acquire(), timeout=self.acquire_timeout)
+        
+        graphiti, healthy = None, True
         try:
-            await graphiti.add_episode(
-                name=f'Apple Intelligence {i}',
-                episode_body=episode.page_content,
-                source=EpisodeType.text,
-                source_description='Bloomberg Technology',
-                reference_time=datetime.now(timezone.utc),
-            )
-            log.info(f"Processed item {i + 1}/10")
+            # created inside the try, so a failing client creation still releases the permit
+            graphiti = self._idle.pop() if self._idle else create_graphiti_instance()
+            yield graphiti
+        except (ServiceUnavailable, SessionExpired):
+            healthy = False
+            raise
+        finally:
+            if graphiti is not None and healthy:
+                self._idle.append(graphiti)
+            elif graphiti is not None:
+                await self._close(graphiti)
+            self._semaphore.release()
+            
+            
+    async def health_check(self) -> bool:
+        """
+            Returns True if a pooled client can reach Neo4j
+        """
+        try:
+            async with self.acquire() as graphiti:
+                await graphiti.driver.execute_query('RETURN 1')
+            return True
         
         except Exception as e:
-            log.error(f"Error processing item {i + 1}/10: {e}")
+            log.error(f'Knowledge graph health check failed: {e}')
+            return False
+        
+        
+    async def startup(self) -> None:
+        """
+            Opens the first client and verifies connectivity ahead of the first request
+        """
+        if not await self.health_check():
+            raise ConnectionError('Unable to connect to the knowledge graph (Neo4j)')
+        
+        log.info('Knowledge graph client pool started')
+        
+        
+    async def shutdown(self) -> None:
+        """
+            Closes every idle client and its Neo4j driver
+        """
+        idle, self._idle = self._idle, []
+        for graphiti in idle:
+            await self._close(graphiti)
+        
+        log.info('Knowledge graph client pool shut down')
+
+
+graphiti_pool = GraphitiPool()
+
+
+def _corpus_fingerprint(doc_splits: list) -> str:
+    digest = hashlib.sha256()
+    for doc in doc_splits:
+        digest.update(hashlib.sha256(doc.page_content.encode('utf-8')).digest())
+    
+    return digest.hexdigest()
+
+
+def load_ingestion_checkpoint(checkpoint_path: Path, fingerprint: str) -> set[int]:
+    """
+        Returns the chunk indices already ingested for this corpus. A checkpoint
+        written for a different set of chunks is ignored.
+    """
+    if not checkpoint_path.exists():
+        return set()
+    
+    checkpoint = json.loads(checkpoint_path.read_text())
+    if checkpoint.get('fingerprint') != fingerprint:
+        log.warning(f'Ignoring checkpoint {checkpoint_path}: it was written for a different corpus')
+        return set()
+    
+    return set(checkpoint.get('completed', []))
+
+
+def save_ingestion_checkpoint(checkpoint_path: Path, fingerprint: str, completed: set[int]) -> None:
+    checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = checkpoint_path.with_suffix('.tmp')
+    tmp_path.write_text(json.dumps({'fingerprint': fingerprint, 'completed': sorted(completed)}))
+    os.replace(tmp_path, checkpoint_path)
+    
+    return
+
+
+def _episode_uuid(fingerprint: str, i: int) -> str:
+    # stable per chunk, so re-adding a partly written batch merges its episodes instead of duplicating them
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f'kg-episode:{fingerprint}:{i}'))
+
+
+async def create_knowledge_graph(
+        pdf_files: list[str],
+        batch_size: int = KG_INGESTION_BATCH_SIZE,
+        max_retries: int = KG_INGESTION_MAX_RETRIES,
+        checkpoint_path: Path = KG_CHECKPOINT_PATH,
+    ) -> dict:
+    """
+        Adds every PDF chunk to the knowledge graph as an episode. Chunks are added
+        in batches of `batch_size` with `add_episode_bulk`, which deduplicates the
+        entities and edges of a batch together; batches run one after another, as
+        deduplication reads the current graph. Each batch is retried with exponential
+        backoff and checkpointed once written, so a re-run skips it.
+
+        Returns:
+            dict: Throughput report of the run
+    """
+    doc_splits = prepare_data(pdf_files)
+    fingerprint = _corpus_fingerprint(doc_splits)
+    completed = load_ingestion_checkpoint(checkpoint_path, fingerprint)
+    pending = [i for i in range(len(doc_splits)) if i not in completed]
+    
+    if completed:
+        log.info(f'Resuming from checkpoint: skipping {len(completed)}/{len(doc_splits)} ingested chunks')
+    
+    failed = []
+    start = time.perf_counter()
+
+    async with graphiti_pool.acquire() as graphiti:
+        await graphiti.build_indices_and_constraints()
+        
+        log.info('Adding episodes to the knowledge graph...')
+        progress = tqdm(total=len(pending), desc='Adding episodes')
+        for batch_start in range(0, len(pending), batch_size):
+            batch = pending[batch_start:batch_start + batch_size]
+            episodes = [
+                RawEpisode(
+                    name=f'Apple Intelligence {i}',
+                    uuid=_episode_uuid(fingerprint, i),
+                    content=doc_splits[i].page_content,
+                    source=EpisodeType.text,
+                    source_description='Bloomberg Technology',
+                    reference_time=datetime.now(timezone.utc),
+                )
+                for i in batch
+            ]
+            try:
+                async for attempt in AsyncRetrying(
+                    stop=stop_after_attempt(max_retries),
+                    wait=wait_exponential(multiplier=1, min=1, max=30),
+                    reraise=True,
+                ):
+                    with attempt:
+                        await graphiti.add_episode_bulk(episodes)
+            
+            except Exception as e:
+                failed.extend(batch)
+                log.error(f'Error processing chunks {batch[0] + 1}-{batch[-1] + 1}/{len(doc_splits)}: {e}')
+            
+            else:
+                completed.update(batch)
+                save_ingestion_checkpoint(checkpoint_path, fingerprint, completed)
+            
+            finally:
+                progress.update(len(batch))
+        
+        progress.close()
+    
+    elapsed = time.perf_counter() - start
+    ingested = len(pending) - len(failed)
+    if ingested:
+        bump_corpus_version()
+    
+    report = {
+        'total_chunks': len(doc_splits),
+        'skipped_chunks': len(doc_splits) - len(pending),
+        'ingested_chunks': ingested,
+        'failed_chunks': sorted(failed),
+        'elapsed_seconds': round(elapsed, 2),
+        'chunks_per_second': round(ingested / elapsed, 3) if elapsed else 0.0,
+    }
+    log.info(f'Knowledge graph ingestion report: {report}')
     
-    log.success('Knowledge graph created successfully!')
+    if failed:
+        log.warning(f'{len(failed)} chunks failed, re-run to retry them')
+    else:
+        log.success('Knowledge graph created successfully!')
     
-    return 
+    return report
 
 
-async def search_knowledge_graph(query: str, limit: int = 5) -> str:
+async def search_knowledge_graph(query: str, limit: int = 5) -> list[str]:
+    """
+        Hybrid search of the knowledge graph nodes. Results are cached until the
+        corpus version changes or the entry expires.
+    """
+    key = (normalize_query(query), limit, get_corpus_version())
+    cached = kg_search_cache.get(key)
+    if cached is not None:
+        record_cache_hit('knowledge_graph')
+        return list(cached)
 
-    graphiti = create_graphiti_instance()
     node_search_config = NODE_HYBRID_SEARCH_RRF.model_copy(deep=True)
     node_search_config.limit = limit 
 
     log.info(f'Searching knowledge graph...')
-    node_search_results = await graphiti._search(
-        query=query,
-        config=node_search_config,
-    )
+    async with graphiti_pool.acquire() as graphiti:
+        node_search_results = await graphiti._search(
+            query=query,
+            config=node_search_config,
+        )
 
     knowledge_graph_info = [
         f"Node Name: {node.name}\nContent Summary: {node.summary}"
         for node in node_search_results.nodes
     ]
+    kg_search_cache.set(key, knowledge_graph_info)
     
-    return knowledge_graph_info
+    return list(knowledge_graph_info)
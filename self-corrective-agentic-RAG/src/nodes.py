@@ -1,15 +1,18 @@
 import os
 import sys
-import ast
 from pathlib import Path
-from typing import List, TypedDict, Annotated
+from collections import OrderedDict
+from typing import List, TypedDict, Annotated, Optional
 import asyncio
+import time
+from collections import deque
 
 sys.path.append(str(Path(__file__).resolve().parents[1]))
+sys.path.append(str(Path(__file__).resolve().parents[2]))
 
 from dotenv import load_dotenv
+from loguru import logger as log
 from pydantic import BaseModel, Field
-from langchain_community.tools import BraveSearch
 from langchain_openai import ChatOpenAI
 from langchain.schema import Document
 from langchain_core.output_parsers import StrOutputParser
@@ -18,17 +21,36 @@ from langgraph.graph import MessagesState
 from langgraph.types import Command
 from langchain_core.tools import tool, InjectedToolCallId
 from langgraph.prebuilt import InjectedState
+from langmem.short_term import RunningSummary
 
-from src.vector import create_vector_retriever
+from src.vector import retrieve_documents, get_embeddings
+from src.cache import SemanticCache
+from src.history import window_history
+from src.context import pack_context
 from src.knowledge_graph import search_knowledge_graph
 from src.prompt import grade_prompt, generate_prompt, re_write_prompt, question_extraction_prompt, tool_description
 from utils.config import ENV_FILE_PATH
+from common.brave_search import get_search_client
+from common.instrumentation import record_cache_hit
 
 load_dotenv(ENV_FILE_PATH)
 
 llm_4o_mini = ChatOpenAI(model='gpt-3.5-turbo')
 llm_4o_mini = ChatOpenAI(model='gpt-4o-mini')
 
+# relevance grading
+GRADER_MAX_CONCURRENCY = int(os.environ.get('GRADER_MAX_CONCURRENCY', 8))
+GRADER_EARLY_EXIT = os.environ.get('GRADER_EARLY_EXIT', 'false').lower() == 'true'
+
+# semantic answer cache
+SEMANTIC_CACHE_ENABLED = os.environ.get('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true'
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', 0.95))
+SEMANTIC_CACHE_TTL = float(os.environ.get('SEMANTIC_CACHE_TTL', 3600))
+
+# speculative web search, started while the documents are still being graded
+WEB_SEARCH_SPECULATIVE = os.environ.get('WEB_SEARCH_SPECULATIVE', 'false').lower() == 'true'
+WEB_SEARCH_SPECULATION_PER_MINUTE = int(os.environ.get('WEB_SEARCH_SPECULATION_PER_MINUTE', 30))
+
 
 class GradeDocuments(BaseModel):
     """Binary score for relevance check on retrieved documents."""
@@ -38,6 +60,28 @@ class GradeDocuments(BaseModel):
     )
 
 
+class SpeculationBudget:
+    """
+        Allows at most `max_per_minute` speculative web searches over a sliding
+        minute, so speculation cannot exhaust the search API quota under load
+    """
+    def __init__(self, max_per_minute: int):
+        self.max_per_minute = max_per_minute
+        self._started: deque[float] = deque()
+
+
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        while self._started and now - self._started[0] > 60:
+            self._started.popleft()
+        
+        if len(self._started) >= self.max_per_minute:
+            return False
+        
+        self._started.append(now)
+        return True
+
+
 # grader llm chain
 structured_llm_grader = llm_4o_mini.with_structured_output(GradeDocuments)
 retrieval_grader = grade_prompt | structured_llm_grader
@@ -51,11 +95,22 @@ question_rewriter = re_write_prompt | llm_4o_mini |StrOutputParser()
 # conversational llm chain
 conversational_chain = llm_4o_mini | StrOutputParser()
 
-# web search tool (Brave Search)
-web_search_tool = BraveSearch.from_api_key(
-    api_key=os.environ.get('BRAVE_SEARCH_API_KEY'),
-    search_kwargs={'count': 3}
-)
+# question extraction llm chain, fallback when the tool call carries no question
+question_extraction_chain = question_extraction_prompt | llm_4o_mini | StrOutputParser()
+extracted_questions: OrderedDict[str, str] = OrderedDict()   # message id -> extracted question
+
+# web search tool (Brave Search), cached and rate limited, shared with the other agents of the process
+web_search_tool = get_search_client(os.environ.get('BRAVE_SEARCH_API_KEY'))
+
+# budget of speculative web searches
+speculation_budget = SpeculationBudget(WEB_SEARCH_SPECULATION_PER_MINUTE)
+
+# answers to previously asked (near-duplicate) questions
+semantic_cache = SemanticCache(
+    embeddings=get_embeddings(),
+    threshold=SEMANTIC_CACHE_THRESHOLD,
+    ttl=SEMANTIC_CACHE_TTL
+) if SEMANTIC_CACHE_ENABLED else None
 
 
 class AgentState(MessagesState):
@@ -69,35 +124,64 @@ class AgentState(MessagesState):
         documents_vs: list of documents from vectorstore
         documents_kg: list of documents from knowledge graph
         documents: list of all documents (vectorstore + knowledge graph)
+        cached_answer: answer found in the semantic cache, empty on a cache miss
+        running_summary: summary of the turns that no longer fit in the history window
+        web_query: question re-written for web search
+        web_searched: whether web results were already added (speculative web search)
     """
     
     user_question: str
     generation: str
+    cached_answer: str
     documents_vs: List[str]
     documents_kg: List[str]
     documents: List[str]
     web_search: str
+    web_query: str
+    web_searched: bool
+    running_summary: Optional[RunningSummary]
  
     
-def generate_query_or_respond(state: AgentState):
+async def generate_query_or_respond(state: AgentState):
     """
         Call the model to generate a response based on the current state. Given
         the question, it will decide to retrieve using the
-        retrieve_from_all_sources tool or simply respond to the user.
+        retrieve_from_all_sources tool or simply respond to the user. Only the
+        history window (running summary + recent turns) is sent to the model.
     """
-    user_query = state['messages']
+    history, running_summary = await window_history(
+        state['messages'],
+        running_summary=state.get('running_summary'),
+        model=llm_4o_mini
+    )
     
     model = llm_4o_mini.bind_tools([retrieve_from_all_sources])
-    response = model.invoke(user_query)
+    response = await model.ainvoke(history)
     
     return {
-        **state,
-        'messages': [response]
+        'messages': [response],
+        'running_summary': running_summary
     }
 
 
+async def extract_question(message) -> str:
+    """
+        Extracts the core question of a user message, cached per message id
+    """
+    if message.id in extracted_questions:
+        return extracted_questions[message.id]
+    
+    question = await question_extraction_chain.ainvoke({'messages': message.content})
+    extracted_questions[message.id] = question
+    while len(extracted_questions) > 256:
+        extracted_questions.popitem(last=False)
+    
+    return question
+
+
 @tool(description=tool_description)
 async def retrieve_from_all_sources(
+        question: Annotated[str, "the user's question, rephrased as a standalone question"],
         state: Annotated[dict, InjectedState],
         tool_call_id: Annotated[str, InjectedToolCallId] 
     ) -> Command:
@@ -105,26 +189,40 @@ async def retrieve_from_all_sources(
         Retrieve Documents from both the vectorstore and knowledge graph
         
         Args:
+            question (str): Standalone question written by the model in the tool call
             state (dict): The current graph state
         
         Returns:
             state (dict): New 'documents_vs' and 'documents_kg' keys added to state, that contains the retrieved documents
     """
     
-    question_extraction_chain = question_extraction_prompt | llm_4o_mini | StrOutputParser()
-    message = state['messages'][-2]
-    question = question_extraction_chain.invoke(message)
-
-    compression_retriever = create_vector_retriever()
+    if not question.strip():
+        question = await extract_question(state['messages'][-2])
+    
+    cached_answer = await semantic_cache.alookup(question) if semantic_cache else None
+    if cached_answer:
+        record_cache_hit('semantic_answer')
+        return Command(
+            update={
+                'user_question': question,
+                'cached_answer': cached_answer,
+                'documents_vs': [],
+                'documents_kg': [],
+                'messages': [
+                    ToolMessage(f"Found a cached answer", tool_call_id=tool_call_id)
+                ]
+            }
+        )
 
     documents_vs, documents_kg = await asyncio.gather(
-        asyncio.to_thread(compression_retriever.invoke, question),
+        asyncio.to_thread(retrieve_documents, question),
         search_knowledge_graph(query=question, limit=5)
     )
     
     return Command(
         update={
             'user_question': question,
+            'cached_answer': '',
             "documents_vs": documents_vs,
             "documents_kg": documents_kg,
             "messages": [
@@ -134,9 +232,16 @@ async def retrieve_from_all_sources(
     )
 
 
-def grade_documents(state: AgentState) -> AgentState:
+async def grade_documents(state: AgentState) -> AgentState:
     """
         Determines whether the retrieved documents are relevant to the question.
+        Documents are graded concurrently, bounded by GRADER_MAX_CONCURRENCY. When
+        GRADER_EARLY_EXIT is enabled, grading stops as soon as one document is
+        graded irrelevant, since the web search fallback is then already decided.
+        
+        When WEB_SEARCH_SPECULATIVE is enabled (and the speculation budget allows it),
+        the query rewrite and web search run concurrently with grading. Their results
+        are added to the documents if a document is irrelevant, and discarded otherwise.
 
         Args:
             state (dict): The current graph state
@@ -150,34 +255,73 @@ def grade_documents(state: AgentState) -> AgentState:
     question = state['user_question']
     
     documents = documents_vs + documents_kg
+    semaphore = asyncio.Semaphore(GRADER_MAX_CONCURRENCY)
+    
+    async def grade(index: int, doc) -> tuple[int, str]:
+        async with semaphore:
+            score = await retrieval_grader.ainvoke(
+                {
+                    'user_question': question,
+                    'document': doc
+                }
+            )
+        
+        return index, score.binary_score
+    
+    speculation = None
+    if WEB_SEARCH_SPECULATIVE and speculation_budget.try_acquire():
+        speculation = asyncio.create_task(search_the_web(question))
     
-    filtered_docs = []
+    tasks = [asyncio.create_task(grade(i, doc)) for i, doc in enumerate(documents)]
+    relevant = set()
     web_search = 'No'
     
-    for doc in documents:
-        score = retrieval_grader.invoke(
-            {
-                'user_question': question,
-                'document': doc
+    try:
+        for next_graded in asyncio.as_completed(tasks):
+            index, grade = await next_graded
+            if grade == 'yes':
+                relevant.add(index)
+            else:
+                web_search = 'Yes'
+                if GRADER_EARLY_EXIT:
+                    break
+    except BaseException:
+        if speculation is not None:
+            speculation.cancel()
+        raise
+    finally:
+        for task in tasks:
+            task.cancel()
+    
+    # keep the retrieval (rerank) order of the documents
+    filtered_docs = [doc for i, doc in enumerate(documents) if i in relevant]
+    
+    if speculation is not None and web_search == 'Yes':
+        try:
+            web_query, web_results = await speculation
+            return {
+                'documents': filtered_docs + [web_results],
+                'web_search': web_search,
+                'web_query': web_query,
+                'web_searched': True
             }
-        )
-        
-        grade = score.binary_score
-        if grade == 'yes':
-            filtered_docs.append(doc)
-        else:
-            web_search = 'Yes'
-            continue
+        except Exception as e:
+            log.warning(f'Speculative web search failed, falling back to the web search path: {e}')
+    
+    elif speculation is not None:
+        speculation.cancel()
     
     return {
         'documents': filtered_docs,
-        'web_search': web_search
+        'web_search': web_search,
+        'web_searched': False
     }
 
 
-def generate_response(state: AgentState) -> AgentState:
+async def generate_response(state: AgentState) -> AgentState:
     """
-        Generate answer
+        Generate answer from the packed context (merged, de-duplicated and
+        relevance-ordered documents within the CONTEXT_MAX_TOKENS budget)
 
         Args:
             state (dict): The current graph state
@@ -187,45 +331,77 @@ def generate_response(state: AgentState) -> AgentState:
     """
     
     question = state['user_question']
-    documents = state['documents']
+    context = pack_context(state['documents'])
 
-    generation = rag_chain.invoke(
+    generation = await rag_chain.ainvoke(
         {
             'user_question': question,
-            'context': documents,
+            'context': context,
         }
     )
     
-    generation = [AIMessage(content=generation)]
+    if semantic_cache:
+        await semantic_cache.aupdate(question, generation)
     
     return {
-        'messages': state['messages'] + generation
+        'messages': [AIMessage(content=generation)]
     }
 
 
-def rewrite_query(state: AgentState) -> AgentState:
+def respond_from_cache(state: AgentState) -> AgentState:
     """
-        Transform the query to produce a better question.
+        Respond with the answer found in the semantic cache
 
         Args:
             state (dict): The current graph state
 
         Returns:
-            state (dict): Updates question key with a re-phrased question
+            state (dict): Cached answer appended to the messages
     """
     
-    question = state['user_question']
-    documents = state['documents']
+    return {
+        'messages': [AIMessage(content=state['cached_answer'])]
+    }
+
+
+async def rewrite_query(state: AgentState) -> AgentState:
+    """
+        Transform the query to produce a better question for web search.
+
+        Args:
+            state (dict): The current graph state
+
+        Returns:
+            state (dict): New web_query key with a re-phrased question
+    """
     
-    question_rewriter.invoke({'user_question': question})
+    question = state['user_question']
+    web_query = await question_rewriter.ainvoke({'user_question': question})
     
     return {
-        'user_question': question,
-        'documents': documents
+        'web_query': web_query
     }
+
+
+async def search_web(query: str) -> Document:
+    """
+        Brave web search, the snippets of the results are joined into one document
+    """
+    results = await web_search_tool.asearch(query, count=3)
+    
+    return Document(page_content="\n".join([result.snippet for result in results]))
+
+
+async def search_the_web(question: str) -> tuple[str, Document]:
+    """
+        Query rewrite followed by the web search, used for speculative web search
+    """
+    web_query = await question_rewriter.ainvoke({'user_question': question})
+    
+    return web_query, await search_web(web_query)
     
 
-def web_search(state: AgentState) -> AgentState:
+async def web_search(state: AgentState) -> AgentState:
     """
         Web search based on the re-phrased question.
 
@@ -236,21 +412,11 @@ def web_search(state: AgentState) -> AgentState:
             state (dict): Updates documents key with appended web results
     """
     
-    question = state['user_question']
-    documents = state['documents']
-    docs = web_search_tool.invoke(
-        {
-            'query': question
-        }
-    )
-
-    web_results = "\n".join([result['snippet'] for result in ast.literal_eval(docs)])
-    web_results = Document(page_content=web_results)
-    documents.append(web_results)
+    query = state.get('web_query') or state['user_question']
+    web_results = await search_web(query)
     
     return {
-        'user_question': question,
-        'documents': documents
+        'documents': state['documents'] + [web_results]
     }
     
 
@@ -267,7 +433,13 @@ def decide_to_generate(state: AgentState) -> AgentState:
     
     web_search = state['web_search']
     
-    if web_search == 'Yes':
+    if web_search == 'Yes' and state.get('web_searched'):
+        print(
+            'WEB RESULTS ALREADY ADDED BY SPECULATIVE SEARCH, GENERATE...'
+        )
+        return 'generate'
+    
+    elif web_search == 'Yes':
         print(
             'ALL DOCUMENTS ARE NOT RELEVANT TO THE QUESTION, TRANSFORM QUERY...'
         )
@@ -279,3 +451,22 @@ def decide_to_generate(state: AgentState) -> AgentState:
         )
         return 'generate'
 
+
+def decide_to_grade(state: AgentState) -> str:
+    """
+        Skips grading and generation when the semantic cache already answered the question.
+
+        Args:
+            state (dict): The current graph state
+
+        Returns:
+            str: Next node to call
+    """
+    
+    if state.get('cached_answer'):
+        print(
+            'SEMANTIC CACHE HIT...'
+        )
+        return 'respond_from_cache'
+    
+    return 'grade_documents'
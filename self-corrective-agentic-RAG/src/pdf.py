@@ -0,0 +1,165 @@
+import os
+import sys
+import io
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import shared_memory
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Iterator, NamedTuple
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+from pypdf import PdfReader
+
+from utils.config import ENV_FILE_PATH
+
+load_dotenv(ENV_FILE_PATH)
+
+
+# PDF parsing runs in worker processes, which import this module again under the
+# spawn start method, so it must not open clients or other resources at import
+PDF_WORKERS = int(os.environ.get('PDF_WORKERS', min(4, os.cpu_count() or 1)))
+PDF_PAGES_PER_TASK = int(os.environ.get('PDF_PAGES_PER_TASK', 16))
+
+
+class SharedPdf(NamedTuple):
+    """An uploaded PDF shared with the worker processes through shared memory"""
+    
+    name: str
+    size: int
+
+
+@lru_cache(maxsize=2)
+def _open_pdf(source: str | bytes | SharedPdf) -> PdfReader:
+    """
+        Opens a PDF path, bytes or shared upload. Readers are cached, so the ranges
+        of a PDF handled by the same process reuse its parsed structure.
+    """
+    if isinstance(source, SharedPdf):
+        segment = shared_memory.SharedMemory(name=source.name)
+        try:
+            source = bytes(segment.buf[:source.size])
+        finally:
+            segment.close()
+    
+    return PdfReader(io.BytesIO(source) if isinstance(source, bytes) else source)
+
+
+def _count_pdf_pages(source: str | bytes | SharedPdf) -> int:
+    return len(_open_pdf(source).pages)
+
+
+def _read_pdf_pages(
+        source: str | bytes | SharedPdf, 
+        name: str, 
+        start: int, 
+        stop: int, 
+        total_pages: int
+    ) -> list[tuple[str, dict]]:
+    """
+        Extracts the text of pages `start` to `stop` (excluded) of a PDF. Runs in a
+        worker process, so it only takes and returns picklable values.
+    """
+    reader = _open_pdf(source)
+    
+    return [
+        (reader.pages[i].extract_text() or '', {'source': name, 'page': i, 'total_pages': total_pages})
+        for i in range(start, stop)
+    ]
+
+
+def source_name(pdf) -> str:
+    """
+        The `source` metadata value of a PDF path or uploaded file
+    """
+    if hasattr(pdf, 'read'):
+        return getattr(pdf, 'name', 'uploaded.pdf')
+    
+    return str(pdf)
+
+
+def _iter_page_ranges(
+        sources: Iterator[tuple[str | bytes | SharedPdf, str]], 
+        pages_per_task: int, 
+        count_pages: Callable[[str | bytes | SharedPdf], int]
+    ) -> Iterator[tuple[str | bytes | SharedPdf, str, int, int, int]]:
+    """
+        Yields (source, name, start, stop, total pages) ranges of at most `pages_per_task`
+        pages, counting the pages of each PDF with `count_pages` once its ranges are reached
+    """
+    for source, name in sources:
+        total_pages = count_pages(source)
+        for start in range(0, total_pages, pages_per_task):
+            yield source, name, start, min(start + pages_per_task, total_pages), total_pages
+
+
+def iter_pdf_pages(
+        pdf_files: list, 
+        max_workers: int = PDF_WORKERS,
+        pages_per_task: int = PDF_PAGES_PER_TASK
+    ) -> Iterator[Document]:
+    """
+        Yields the pages of the PDFs in order. Each PDF is split in ranges of
+        `pages_per_task` pages parsed in a process pool, a single large PDF included,
+        and the pages of a range are yielded as soon as it and the ranges before it
+        are done. At most two ranges per worker are in flight, so memory does not
+        grow with the size of the corpus.
+
+        Uploaded files (objects with `.read()`) are read when their pages are reached
+        and parsed from memory: their bytes are copied once into shared memory, which
+        the workers read from, and released after their last page.
+    """
+    if max_workers <= 1:
+        sources = ((pdf.read() if hasattr(pdf, 'read') else str(pdf), source_name(pdf)) for pdf in pdf_files)
+        for page_range in _iter_page_ranges(sources, pages_per_task, _count_pdf_pages):
+            for text, metadata in _read_pdf_pages(*page_range):
+                yield Document(page_content=text, metadata=metadata)
+        return
+    
+    segments: dict[str, shared_memory.SharedMemory] = {}
+    
+    def share(pdf) -> tuple[str | SharedPdf, str]:
+        if not hasattr(pdf, 'read'):
+            return str(pdf), source_name(pdf)
+        
+        data = pdf.read()
+        segment = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+        segment.buf[:len(data)] = data
+        segments[segment.name] = segment
+        
+        return SharedPdf(segment.name, len(data)), source_name(pdf)
+    
+    def release(name: str) -> None:
+        segment = segments.pop(name)
+        segment.close()
+        segment.unlink()
+    
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        # page counts are read by a worker too, the caller's process does not parse PDFs
+        count_pages = lambda source: executor.submit(_count_pdf_pages, source).result()
+        ranges = _iter_page_ranges((share(pdf) for pdf in pdf_files), pages_per_task, count_pages)
+        in_flight = deque(
+            (executor.submit(_read_pdf_pages, *page_range), page_range) 
+            for page_range in islice(ranges, 2 * max_workers)
+        )
+        while in_flight:
+            future, (source, _, _, stop, total_pages) = in_flight.popleft()
+            pages = future.result()
+            if isinstance(source, SharedPdf) and stop == total_pages:
+                release(source.name)
+            
+            for page_range in islice(ranges, 1):
+                in_flight.append((executor.submit(_read_pdf_pages, *page_range), page_range))
+            
+            for text, metadata in pages:
+                yield Document(page_content=text, metadata=metadata)
+    
+    finally:
+        executor.shutdown(cancel_futures=True)
+        for name in list(segments):
+            release(name)
@@ -77,4 +77,6 @@ Search and return information about Bloomberg's March 14, 2025 report on Apple's
 The tool can return details about delayed features, Siri’s redesign, leadership changes, acquisitions, technical challenges, 
 financial impact, competitive positioning, and Apple’s recovery strategy. Useful for answering questions about Apple’s AI 
 struggles, market position, and long-term strategy in the AI space.
+Pass the user's core question about the report as `question`, rephrased as a standalone question 
+(e.g. "I'm curious, how much did Apple spend on acquisitions?" -> "How much did Apple spend on acquisitions?").
 """
\ No newline at end of file
@@ -0,0 +1,176 @@
+import os
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional, Sequence
+
+import numpy as np
+from loguru import logger as log
+from flashrank import Ranker, RerankRequest
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import Document
+from langchain_core.documents.compressor import BaseDocumentCompressor
+
+
+# the model of langchain's FlashrankRerank, flashrank's own default is the much smaller ms-marco-TinyBERT-L-2-v2
+RERANKER_MODEL = os.environ.get('RERANKER_MODEL', 'ms-marco-MultiBERT-L-12')
+RERANKER_BATCH_WINDOW_MS = float(os.environ.get('RERANKER_BATCH_WINDOW_MS', 5))
+RERANKER_MAX_BATCH_PAIRS = int(os.environ.get('RERANKER_MAX_BATCH_PAIRS', 128))
+RERANKER_WORKERS = int(os.environ.get('RERANKER_WORKERS', os.cpu_count() or 1))
+
+
+class _RerankJob:
+    def __init__(self, query: str, passages: list[str]):
+        self.query = query
+        self.passages = passages
+        self.future: Future = Future()
+
+
+class RerankerService:
+    """
+        Process-wide Flashrank reranker. The model (ONNX session and tokenizer) is
+        loaded once, and rerank requests of concurrent sessions arriving within
+        `batch_window_ms` of each other are scored in a single model call, up to
+        `max_batch_pairs` (query, passage) pairs. Batches run on a pool of `workers`
+        threads, ONNX Runtime releases the GIL while scoring.
+    """
+    def __init__(
+            self,
+            ranker: Ranker,
+            batch_window_ms: float = RERANKER_BATCH_WINDOW_MS,
+            max_batch_pairs: int = RERANKER_MAX_BATCH_PAIRS,
+            workers: int = RERANKER_WORKERS
+        ):
+        self.ranker = ranker
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch_pairs = max_batch_pairs
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='reranker')
+        self._pending: list[_RerankJob] = []
+        self._condition = threading.Condition()
+        self._batcher: Optional[threading.Thread] = None
+
+
+    def rerank(self, query: str, passages: list[str]) -> list[float]:
+        """
+            Relevance scores of the passages for the query, in the order of the passages.
+            Blocks until the batch containing the request is scored.
+        """
+        if not passages:
+            return []
+
+        job = _RerankJob(query, passages)
+        with self._condition:
+            if self._batcher is None:
+                self._batcher = threading.Thread(target=self._collect_batches, name='reranker-batcher', daemon=True)
+                self._batcher.start()
+            self._pending.append(job)
+            self._condition.notify()
+
+        return job.future.result()
+
+
+    def _collect_batches(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+
+                # wait for concurrent requests, unless the batch is already full
+                deadline = time.monotonic() + self.batch_window
+                while sum(len(job.passages) for job in self._pending) < self.max_batch_pairs:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+                batch, n_pairs = [], 0
+                while self._pending and (not batch or n_pairs + len(self._pending[0].passages) <= self.max_batch_pairs):
+                    job = self._pending.pop(0)
+                    batch.append(job)
+                    n_pairs += len(job.passages)
+
+            self._executor.submit(self._run_batch, batch)
+
+
+    def _run_batch(self, batch: list[_RerankJob]) -> None:
+        try:
+            if self.ranker.llm_model is not None:
+                # listwise models rank the passages of one query at a time
+                scores = [self._rerank_listwise(job) for job in batch]
+            else:
+                pairs = [[job.query, passage] for job in batch for passage in job.passages]
+                flat_scores = self._score_pairs(pairs)
+                scores, start = [], 0
+                for job in batch:
+                    scores.append(flat_scores[start:start + len(job.passages)].tolist())
+                    start += len(job.passages)
+        except Exception as e:
+            log.error(f'Reranking a batch of {len(batch)} requests failed: {e}')
+            for job in batch:
+                job.future.set_exception(e)
+            return
+
+        for job, job_scores in zip(batch, scores):
+            job.future.set_result(job_scores)
+
+
+    def _score_pairs(self, pairs: list[list[str]]) -> np.ndarray:
+        """
+            Cross-encoder scores of (query, passage) pairs, as flashrank's pairwise reranking
+        """
+        encodings = self.ranker.tokenizer.encode_batch(pairs)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        token_type_ids = np.array([e.type_ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+
+        onnx_input = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        if np.any(token_type_ids):
+            onnx_input['token_type_ids'] = token_type_ids
+
+        logits = self.ranker.session.run(None, onnx_input)[0]
+        if logits.shape[1] == 1:
+            return 1 / (1 + np.exp(-logits.flatten()))
+
+        exp_logits = np.exp(logits)
+        return exp_logits[:, 1] / np.sum(exp_logits, axis=1)
+
+
+    def _rerank_listwise(self, job: _RerankJob) -> list[float]:
+        # listwise models return an order, scored here by reciprocal rank
+        passages = [{'id': i, 'text': passage} for i, passage in enumerate(job.passages)]
+        ranked = self.ranker.rerank(RerankRequest(query=job.query, passages=passages))
+        scores = [0.0] * len(passages)
+        for rank, passage in enumerate(ranked):
+            scores[passage['id']] = 1 / (rank + 1)
+
+        return scores
+
+
+@lru_cache(maxsize=1)
+def get_reranker_service() -> RerankerService:
+    return RerankerService(Ranker(model_name=RERANKER_MODEL))
+
+
+class BatchedFlashrankRerank(BaseDocumentCompressor):
+    """
+        Document compressor reranking through the shared RerankerService, a drop-in
+        replacement of langchain's FlashrankRerank
+    """
+    top_n: int = 3
+    score_threshold: float = 0.0
+
+    def compress_documents(
+            self,
+            documents: Sequence[Document],
+            query: str,
+            callbacks: Callbacks = None
+        ) -> Sequence[Document]:
+        scores = get_reranker_service().rerank(query, [doc.page_content for doc in documents])
+        ranked = sorted(zip(scores, documents), key=lambda item: item[0], reverse=True)
+
+        return [
+            Document(page_content=doc.page_content, metadata={**doc.metadata, 'relevance_score': float(score)})
+            for score, doc in ranked[:self.top_n]
+            if score >= self.score_threshold
+        ]
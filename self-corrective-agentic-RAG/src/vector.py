@@ -1,91 +1,241 @@
 import os
 import sys
-import tempfile
+import uuid
+import hashlib
+import threading
+from functools import lru_cache
+from itertools import islice
 from pathlib import Path
-from xmlrpc import client
+from typing import Iterator, Literal, Optional
 
 from dotenv import load_dotenv
 from loguru import logger as log
+from pydantic import BaseModel
+from qdrant_client import models
 
-from langchain.retrievers import ContextualCompressionRetriever
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.retrievers import ContextualCompressionRetriever, EnsembleRetriever
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_compressors import FlashrankRerank
-from langchain_community.document_loaders import PyPDFLoader
+from langchain_community.retrievers import BM25Retriever
 from langchain_community.vectorstores import Qdrant
+from langchain_core.documents import Document
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 sys.path.append(str(Path(__file__).resolve().parents[2]))
 
 from utils.config import ENV_FILE_PATH
-from utils.helper_functions import create_qdrant_client
+from src.pdf import PDF_WORKERS, iter_pdf_pages, source_name
+from src.cache import SQLiteLRUByteStore, bump_corpus_version, get_corpus_version
+from src.reranker import BatchedFlashrankRerank, get_reranker_service
+from src.vector_backend import create_collection, create_vector_client, search_params
+from common.cache import TTLCache, normalize_query
+from common.instrumentation import record_cache_hit
 
 load_dotenv(ENV_FILE_PATH)
 
 
-qdrant_client = create_qdrant_client(
-    url=os.getenv('QDRANT_URL'),
-    api_key=os.getenv('QDRANT_API_KEY'),
-    collection_name='self_corrective_agentic_rag'
+DEFAULT_COLLECTION = 'self_corrective_agentic_rag'
+INGESTION_BATCH_SIZE = int(os.environ.get('INGESTION_BATCH_SIZE', 64))
+EMBEDDING_MODEL = os.environ.get('EMBEDDING_MODEL', 'text-embedding-ada-002')
+EMBEDDING_CACHE_PATH = os.environ.get(
+    'EMBEDDING_CACHE_PATH', str(Path(__file__).resolve().parents[1] / 'data' / 'embedding_cache.sqlite')
 )
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', 50_000))
+RETRIEVAL_CACHE_TTL = float(os.environ.get('RETRIEVAL_CACHE_TTL', 600))
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.environ.get('RETRIEVAL_CACHE_MAX_ENTRIES', 512))
 
 
-def prepare_data(pdf_files: list[str]) -> list:
-    docs = []
 
-    for pdf in pdf_files:
-        if hasattr(pdf, 'read'):
-            pdf_bytes = pdf.read()
-            tmp_file_path = None
-            try:
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-                    tmp_file.write(pdf_bytes)
-                    tmp_file_path = tmp_file.name
+class RetrieverSettings(BaseModel):
+    """Retrieval tuning of a collection."""
+    
+    search_mode: Literal['dense', 'hybrid'] = 'dense'
+    candidate_k: int = 7        # candidates fetched by each retriever before reranking
+    rerank_top_n: int = 3       # documents kept after reranking
+    dense_weight: float = 0.5   # weight of the dense retriever in reciprocal-rank fusion
+    rrf_k: int = 60             # reciprocal-rank fusion constant
 
-                loader = PyPDFLoader(tmp_file_path)
-                docs.extend(loader.load())
 
-            finally:
-                if tmp_file_path and os.path.exists(tmp_file_path):
-                    os.remove(tmp_file_path)
+COLLECTION_SETTINGS: dict[str, RetrieverSettings] = {
+    DEFAULT_COLLECTION: RetrieverSettings(
+        search_mode=os.environ.get('RETRIEVAL_MODE', 'dense'),
+        candidate_k=int(os.environ.get('RETRIEVAL_CANDIDATE_K', 7)),
+        rerank_top_n=int(os.environ.get('RETRIEVAL_RERANK_TOP_N', 3)),
+        dense_weight=float(os.environ.get('RETRIEVAL_DENSE_WEIGHT', 0.5)),
+    ),
+}
 
-        else:
-            loader = PyPDFLoader(pdf)
-            docs.extend(loader.load())
+# remote Qdrant server, or embedded on disk / in memory, depending on VECTOR_BACKEND
+qdrant_client = create_vector_client(collection_name=DEFAULT_COLLECTION)
+
+# process-wide retrievers, keyed by collection name, with the corpus version they were built on
+_retriever_registry: dict[str, tuple[int, ContextualCompressionRetriever]] = {}
+_registry_lock = threading.Lock()
+
+# reranked documents of recent questions, keyed by collection, normalized question and corpus version
+retrieval_cache = TTLCache(ttl=RETRIEVAL_CACHE_TTL, max_entries=RETRIEVAL_CACHE_MAX_ENTRIES)
 
-    splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+
+@lru_cache(maxsize=1)
+def get_text_splitter() -> RecursiveCharacterTextSplitter:
+    # start_index: position of the chunk in its page, used to merge overlapping chunks in the context
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
         chunk_size=250,
-        chunk_overlap=50
+        chunk_overlap=50,
+        add_start_index=True
     )
-    split_docs = splitter.split_documents(docs)
-    
-    return [doc for doc in split_docs if doc.page_content]
 
 
-def create_vector_database(pdf_files: list[str], collection_name: str = 'self_corrective_agentic_rag') -> None:
-    doc_splits = prepare_data(pdf_files)
+def iter_document_chunks(pdf_files: list, max_workers: int = PDF_WORKERS) -> Iterator[Document]:
+    """
+        Yields the non-empty chunks of the PDFs, splitting one page at a time
+    """
+    splitter = get_text_splitter()
+    for page in iter_pdf_pages(pdf_files, max_workers=max_workers):
+        for chunk in splitter.split_documents([page]):
+            if chunk.page_content:
+                yield chunk
+
+
+def iter_chunk_batches(
+        pdf_files: list, 
+        batch_size: int = INGESTION_BATCH_SIZE,
+        max_workers: int = PDF_WORKERS
+    ) -> Iterator[list[Document]]:
+    """
+        Yields the chunks of the PDFs in lists of at most `batch_size` documents
+    """
+    chunks = iter_document_chunks(pdf_files, max_workers=max_workers)
+    while batch := list(islice(chunks, batch_size)):
+        yield batch
+
+
+def prepare_data(pdf_files: list[str]) -> list:
+    return list(iter_document_chunks(pdf_files))
+
+
+def chunk_id(doc: Document) -> str:
+    """
+        Deterministic point ID derived from the chunk's source, page and content hash
+    """
+    content_hash = hashlib.sha256(doc.page_content.encode('utf-8')).hexdigest()
+    key = f"{doc.metadata.get('source')}:{doc.metadata.get('page')}:{content_hash}"
     
-    if collection_name not in [c.name for c in client.get_collections().collections]:
-        log.info(f'Creating new collection: {collection_name}')
-        
-        Qdrant.from_documents(
-            api_key=os.getenv('QDRANT_API_KEY'),
-            url=os.getenv('QDRANT_URL'),
-            documents=doc_splits,
-            embedding=OpenAIEmbeddings,
-            collection_name=collection_name,
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, key))
+
+
+def upsert_documents(
+        vectorstore: Qdrant, 
+        doc_splits: list[Document], 
+        batch_size: int = INGESTION_BATCH_SIZE
+    ) -> list[str]:
+    """
+        Writes chunks under their deterministic IDs, skipping the ones already stored
+
+        Returns:
+            list[str]: IDs of all the given chunks
+    """
+    docs_by_id = {chunk_id(doc): doc for doc in doc_splits}
+    existing = {
+        str(point.id) for point in qdrant_client.retrieve(
+            collection_name=vectorstore.collection_name,
+            ids=list(docs_by_id),
+            with_payload=False,
+            with_vectors=False,
         )
+    }
+    new_docs = {point_id: doc for point_id, doc in docs_by_id.items() if point_id not in existing}
+    
+    if new_docs:
+        vectorstore.add_documents(list(new_docs.values()), ids=list(new_docs), batch_size=batch_size)
+    
+    log.info(f'Upserted {len(new_docs)} new chunks, {len(existing)} already stored')
+    
+    return list(docs_by_id)
+
+
+def delete_source_documents(
+        source: str, 
+        collection_name: str = DEFAULT_COLLECTION,
+        keep_ids: list[str] | None = None
+    ) -> None:
+    """
+        Deletes every chunk of a source document, except the points in `keep_ids`
+    """
+    qdrant_client.delete(
+        collection_name=collection_name,
+        points_selector=models.FilterSelector(
+            filter=models.Filter(
+                must=[models.FieldCondition(key='metadata.source', match=models.MatchValue(value=source))],
+                must_not=[models.HasIdCondition(has_id=keep_ids)] if keep_ids else None,
+            )
+        ),
+    )
+    invalidate_vector_retriever(collection_name)
+    bump_corpus_version()
+    
+    return
+
+
+def create_vector_database(
+        pdf_files: list[str], 
+        collection_name: str = DEFAULT_COLLECTION, 
+        batch_size: int = INGESTION_BATCH_SIZE
+    ) -> None:
+    if collection_name in [c.name for c in qdrant_client.get_collections().collections]:
+        log.info(f'Collection already exists: {collection_name}')
+        return
+    
+    log.info(f'Creating new collection: {collection_name}')
+    
+    vectorstore = Qdrant(
+        client=qdrant_client,
+        collection_name=collection_name,
+        embeddings=get_embeddings()
+    )
+    for doc_splits in iter_chunk_batches(pdf_files, batch_size=batch_size):
+        if not qdrant_client.collection_exists(collection_name):
+            # the embedding of the first chunk is cached, it is not computed again when the batch is written
+            vector_size = len(get_embeddings().embed_documents([doc_splits[0].page_content])[0])
+            create_collection(qdrant_client, collection_name, vector_size)
+        upsert_documents(vectorstore, doc_splits, batch_size=batch_size)
     
+    bump_corpus_version()
     log.success('Vector store created successfully!')
     
     return
 
 
+@lru_cache(maxsize=1)
+def get_embeddings() -> CacheBackedEmbeddings:
+    """
+        OpenAI embeddings behind a persistent cache keyed by the SHA-256 of the chunk
+        content, namespaced by model name, so re-ingesting a chunk skips the API call
+    """
+    return CacheBackedEmbeddings.from_bytes_store(
+        underlying_embeddings=OpenAIEmbeddings(model=EMBEDDING_MODEL),
+        document_embedding_cache=SQLiteLRUByteStore(EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES),
+        namespace=EMBEDDING_MODEL,
+        key_encoder='sha256',
+    )
+
+
+def get_reranker(top_n: int = 3) -> BatchedFlashrankRerank:
+    """
+        Flashrank reranker backed by the process-wide reranker service, which loads
+        the model once and batches the rerank requests of concurrent sessions
+    """
+    get_reranker_service()
+
+    return BatchedFlashrankRerank(top_n=top_n)
+
+
 def add_reranker(vectorstore: Qdrant) -> ContextualCompressionRetriever:
     
-    retriever = vectorstore.as_retriever(search_kwargs={'k': 7})
+    retriever = vectorstore.as_retriever(search_kwargs={'k': 7, 'search_params': search_params()})
     
-    compressor = FlashrankRerank(top_n=3)
+    compressor = get_reranker()
     compression_retriever = ContextualCompressionRetriever(
         base_compressor=compressor,
         base_retriever=retriever
@@ -94,35 +244,92 @@ def add_reranker(vectorstore: Qdrant) -> ContextualCompressionRetriever:
     return compression_retriever
 
 
-def add_documents_to_vectorstore(pdf_paths: list[str], collection_name: str = 'self_corrective_agentic_rag') -> None:
-    
-    doc_splits = prepare_data(pdf_paths)
-    
+def add_documents_to_vectorstore(
+        pdf_paths: list[str], 
+        collection_name: str = DEFAULT_COLLECTION,
+        batch_size: int = INGESTION_BATCH_SIZE,
+        replace: bool = False
+    ) -> None:
+    """
+        Upserts the chunks of the PDFs. Chunks already in the collection are not written
+        again, and with `replace=True` chunks of these sources that are no longer part
+        of the documents are deleted.
+    """
     vectorstore = Qdrant(
         client=qdrant_client,
         collection_name=collection_name,
-        embeddings=OpenAIEmbeddings()
+        embeddings=get_embeddings()
     )
-    vectorstore.add_documents(doc_splits)
+    
+    chunk_ids = []
+    for doc_splits in iter_chunk_batches(pdf_paths, batch_size=batch_size):
+        chunk_ids.extend(upsert_documents(vectorstore, doc_splits, batch_size=batch_size))
+    
+    if replace:
+        for pdf in pdf_paths:
+            delete_source_documents(source_name(pdf), collection_name=collection_name, keep_ids=chunk_ids)
+    
+    invalidate_vector_retriever(collection_name)
+    bump_corpus_version()
 
     log.success('New PDF documents added to vectorstore!')
     
     return
 
 
-def create_vector_retriever(collection_name: str = 'self_corrective_agentic_rag') -> ContextualCompressionRetriever:
+def get_retriever_settings(collection_name: str = DEFAULT_COLLECTION) -> RetrieverSettings:
+    return COLLECTION_SETTINGS.get(collection_name, RetrieverSettings())
+
+
+def load_collection_documents(collection_name: str = DEFAULT_COLLECTION) -> list[Document]:
+    """
+        Reads every chunk stored in a collection, used to build the sparse (BM25) index
+    """
+    docs, offset = [], None
+    while True:
+        points, offset = qdrant_client.scroll(
+            collection_name=collection_name,
+            limit=256,
+            offset=offset,
+            with_payload=True,
+            with_vectors=False,
+        )
+        docs.extend(
+            Document(page_content=point.payload.get('page_content', ''), metadata=point.payload.get('metadata') or {})
+            for point in points
+        )
+        if offset is None:
+            return docs
+
+
+def create_vector_retriever(collection_name: str = DEFAULT_COLLECTION) -> ContextualCompressionRetriever:
+    settings = get_retriever_settings(collection_name)
     vectorstore = Qdrant(
         client=qdrant_client,
         collection_name=collection_name,
-        embeddings=OpenAIEmbeddings()
+        embeddings=get_embeddings()
     )
     
     retriever = vectorstore.as_retriever(
         search_type='mmr',
-        search_kwargs={'k':7}
+        search_kwargs={'k': settings.candidate_k, 'search_params': search_params()}
     )
     
-    compressor = FlashrankRerank(top_n=3)
+    if settings.search_mode == 'hybrid':
+        documents = load_collection_documents(collection_name)
+        if documents:
+            # exact-term matches (product names, codes) that dense search misses
+            sparse_retriever = BM25Retriever.from_documents(documents, k=settings.candidate_k)
+            retriever = EnsembleRetriever(
+                retrievers=[retriever, sparse_retriever],
+                weights=[settings.dense_weight, 1 - settings.dense_weight],
+                c=settings.rrf_k
+            )
+        else:
+            # BM25 cannot index an empty corpus, the retriever is rebuilt once documents are ingested
+            log.warning(f'Collection {collection_name} is empty, using dense retrieval until documents are added')
+    
+    compressor = get_reranker(top_n=settings.rerank_top_n)
     compression_retriever = ContextualCompressionRetriever(
         base_compressor=compressor,
         base_retriever=retriever
@@ -131,6 +338,75 @@ def create_vector_retriever(collection_name: str = 'self_corrective_agentic_rag'
     return compression_retriever
 
 
+def get_vector_retriever(
+        collection_name: str = DEFAULT_COLLECTION,
+        corpus_version: Optional[int] = None
+    ) -> ContextualCompressionRetriever:
+    """
+        Returns the shared retriever for a collection, building it on first use and
+        rebuilding it when the corpus version changed (documents ingested by another
+        process), so the BM25 index of hybrid retrieval is never stale.
+        The registry is shared across threads, so concurrent requests reuse the
+        same Qdrant wrapper, embeddings client and reranker model.
+    """
+    if corpus_version is None:
+        corpus_version = get_corpus_version()
+    
+    entry = _retriever_registry.get(collection_name)
+    if entry is not None and entry[0] == corpus_version:
+        return entry[1]
+    
+    with _registry_lock:
+        entry = _retriever_registry.get(collection_name)
+        if entry is None or entry[0] != corpus_version:
+            log.info(f'Building retriever for collection: {collection_name} (corpus version {corpus_version})')
+            entry = _retriever_registry[collection_name] = (corpus_version, create_vector_retriever(collection_name))
+        
+        return entry[1]
+
+
+def retrieve_documents(question: str, collection_name: str = DEFAULT_COLLECTION) -> list[Document]:
+    """
+        Retrieves the reranked documents of a question. Results are cached, so
+        re-asked questions skip the embedding, the vector search and the reranking
+        until the corpus version changes or the entry expires.
+    """
+    corpus_version = get_corpus_version()
+    key = (collection_name, normalize_query(question), corpus_version)
+    documents = retrieval_cache.get(key)
+    if documents is None:
+        documents = get_vector_retriever(collection_name, corpus_version).invoke(question)
+        retrieval_cache.set(key, documents)
+    else:
+        record_cache_hit('retrieval')
+    
+    return list(documents)
+
+
+def invalidate_vector_retriever(collection_name: str = DEFAULT_COLLECTION) -> None:
+    """
+        Drops the cached retriever of a collection so the next request rebuilds it
+    """
+    with _registry_lock:
+        _retriever_registry.pop(collection_name, None)
+    
+    return
+
+
+def warm_up_retrievers(collection_names: tuple[str, ...] = (DEFAULT_COLLECTION,)) -> None:
+    """
+        Builds the retrievers (and loads the reranker model) ahead of the first request.
+        A collection that cannot be loaded yet (e.g. not created) is built on first use instead.
+    """
+    for collection_name in collection_names:
+        try:
+            get_vector_retriever(collection_name)
+        except Exception as e:
+            log.warning(f'Could not warm up the retriever of {collection_name}, it will be built on first use: {e}')
+    
+    return
+
+
 
 if __name__ == '__main__':
     pdf_paths = ['/home/ubuntu/datascience/Generative-AI-Agents-langChain-langGraph-/self-corrective-agentic-RAG/data/data.pdf']
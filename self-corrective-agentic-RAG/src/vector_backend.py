@@ -0,0 +1,238 @@
+import os
+import sys
+import time
+import random
+from pathlib import Path
+from typing import Callable, Literal, Optional
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from dotenv import load_dotenv
+from loguru import logger as log
+from qdrant_client import QdrantClient, models
+
+from utils.config import ENV_FILE_PATH
+
+load_dotenv(ENV_FILE_PATH)
+
+
+# where the vector store lives: 'remote' (Qdrant server), 'local' (embedded, on disk) or 'memory'
+VECTOR_BACKEND = os.environ.get('VECTOR_BACKEND', 'remote')
+VECTOR_STORE_PATH = os.environ.get(
+    'VECTOR_STORE_PATH', str(Path(__file__).resolve().parents[1] / 'data' / 'qdrant')
+)
+
+# vector storage: quantized vectors are searched in RAM, the full-precision vectors
+# are memory-mapped from disk and only read to rescore the top candidates
+VECTOR_QUANTIZATION = os.environ.get('VECTOR_QUANTIZATION', 'none')
+VECTOR_ON_DISK = os.environ.get('VECTOR_ON_DISK', str(VECTOR_QUANTIZATION != 'none')).lower() == 'true'
+VECTOR_RESCORE_OVERSAMPLING = float(os.environ.get('VECTOR_RESCORE_OVERSAMPLING', 2.0))
+
+# stored bytes per dimension of each quantization, full precision being 4 (float32)
+BYTES_PER_DIMENSION = {'none': 4, 'scalar': 1, 'binary': 1 / 8, 'product': 4 / 16}
+
+_backend_registry: dict[str, Callable[[str], QdrantClient]] = {}
+
+
+def register_backend(name: str):
+    """
+        Registers a factory of the Qdrant client of a backend, called with the default collection name
+    """
+    def decorator(factory: Callable[[str], QdrantClient]):
+        _backend_registry[name] = factory
+
+        return factory
+
+    return decorator
+
+
+@register_backend('remote')
+def remote_client(collection_name: str) -> QdrantClient:
+    # every retrieval is a network round trip to the Qdrant server
+    from utils.helper_functions import create_qdrant_client
+
+    return create_qdrant_client(
+        url=os.getenv('QDRANT_URL'),
+        api_key=os.getenv('QDRANT_API_KEY'),
+        collection_name=collection_name
+    )
+
+
+@register_backend('local')
+def local_client(collection_name: str) -> QdrantClient:
+    # embedded Qdrant persisted in VECTOR_STORE_PATH, searched in process. The
+    # directory is locked, so only one process can open it.
+    Path(VECTOR_STORE_PATH).mkdir(parents=True, exist_ok=True)
+
+    return QdrantClient(path=VECTOR_STORE_PATH)
+
+
+@register_backend('memory')
+def memory_client(collection_name: str) -> QdrantClient:
+    # embedded Qdrant kept in memory, lost on restart (tests, benchmarks)
+    return QdrantClient(location=':memory:')
+
+
+def create_vector_client(collection_name: str, backend: str = VECTOR_BACKEND) -> QdrantClient:
+    """
+        Creates the Qdrant client of the configured backend. The embedded backends
+        expose the same client API as the server, so the vector store, retrievers
+        and ingestion work unchanged on top of any of them.
+    """
+    if backend not in _backend_registry:
+        raise ValueError(f'Unknown vector backend {backend!r}, expected one of {sorted(_backend_registry)}')
+
+    log.info(f'Using the {backend} vector backend')
+
+    return _backend_registry[backend](collection_name)
+
+
+def quantization_config(
+        quantization: Literal['none', 'scalar', 'binary', 'product'] = VECTOR_QUANTIZATION
+    ) -> Optional[models.QuantizationConfig]:
+    """
+        Qdrant quantization of the stored vectors: 'scalar' (int8, 4x smaller),
+        'binary' (1 bit per dimension, 32x) or 'product' (16x). The quantized
+        vectors are kept in RAM.
+    """
+    if quantization == 'none':
+        return None
+    if quantization == 'scalar':
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True)
+        )
+    if quantization == 'binary':
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+    if quantization == 'product':
+        return models.ProductQuantization(
+            product=models.ProductQuantizationConfig(compression=models.CompressionRatio.X16, always_ram=True)
+        )
+
+    raise ValueError(f'Unknown vector quantization {quantization!r}, expected none, scalar, binary or product')
+
+
+def search_params(
+        quantization: str = VECTOR_QUANTIZATION,
+        oversampling: float = VECTOR_RESCORE_OVERSAMPLING
+    ) -> Optional[models.SearchParams]:
+    """
+        Search parameters of the retrievers: `oversampling` x k candidates are found
+        with the quantized vectors, then rescored with the full-precision ones
+    """
+    if quantization == 'none':
+        return None
+
+    return models.SearchParams(
+        quantization=models.QuantizationSearchParams(rescore=True, oversampling=oversampling)
+    )
+
+
+def create_collection(
+        client: QdrantClient,
+        collection_name: str,
+        vector_size: int,
+        quantization: str = VECTOR_QUANTIZATION,
+        on_disk: bool = VECTOR_ON_DISK
+    ) -> None:
+    """
+        Creates a collection of cosine-distance vectors, as langchain's Qdrant.from_documents
+        does, quantized and with the original vectors on disk if configured. The
+        embedded backends accept but do not apply quantization.
+    """
+    client.create_collection(
+        collection_name=collection_name,
+        vectors_config=models.VectorParams(size=vector_size, distance=models.Distance.COSINE, on_disk=on_disk),
+        quantization_config=quantization_config(quantization),
+    )
+
+
+def quantize_collection(
+        client: QdrantClient,
+        collection_name: str,
+        quantization: str = VECTOR_QUANTIZATION,
+        on_disk: bool = VECTOR_ON_DISK
+    ) -> None:
+    """
+        Applies the quantization to an existing collection, Qdrant re-indexes it in the background
+    """
+    client.update_collection(
+        collection_name=collection_name,
+        vectors_config={'': models.VectorParamsDiff(on_disk=on_disk)},
+        quantization_config=quantization_config(quantization) or models.Disabled.DISABLED,
+    )
+    log.info(f'Collection {collection_name} quantization set to {quantization}, on disk: {on_disk}')
+
+
+def recall_report(
+        client: QdrantClient,
+        collection_name: str,
+        k_values: tuple[int, ...] = (1, 3, 7, 10),
+        n_queries: int = 100,
+        oversampling: float = VECTOR_RESCORE_OVERSAMPLING,
+        seed: int = 0
+    ) -> dict:
+    """
+        Measures the recall@k of the quantized search against exact full-precision search.
+        Vectors of randomly sampled stored chunks are used as queries, so no embedding
+        call is made. The query chunk itself is left out of every result list, it would
+        otherwise be a free top-1 hit of each search. Recall is reported with and
+        without rescoring.
+
+        Returns:
+            dict: Number of points, vector size, estimated vector memory per quantization,
+                recall@k and mean search latency (ms) per search mode
+    """
+    info = client.get_collection(collection_name)
+    vectors_config = info.config.params.vectors
+    n_points, vector_size = info.points_count or 0, vectors_config.size
+
+    point_ids, offset = [], None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name, limit=1024, offset=offset, with_payload=False, with_vectors=False
+        )
+        point_ids.extend(point.id for point in points)
+        if offset is None:
+            break
+
+    sample = random.Random(seed).sample(point_ids, min(n_queries, len(point_ids)))
+    queries = [(point.id, point.vector) for point in client.retrieve(collection_name, ids=sample, with_vectors=True)]
+
+    modes = {
+        'exact': models.SearchParams(exact=True),
+        'quantized': models.SearchParams(quantization=models.QuantizationSearchParams(rescore=False)),
+        'quantized + rescore': models.SearchParams(
+            quantization=models.QuantizationSearchParams(rescore=True, oversampling=oversampling)
+        ),
+    }
+    limit = max(k_values)
+    results, latency = {}, {}
+    for mode, params in modes.items():
+        start = time.perf_counter()
+        results[mode] = [
+            [point.id for point in client.query_points(
+                collection_name=collection_name, query=query, limit=limit + 1, search_params=params, with_payload=False
+            ).points if point.id != query_id][:limit]
+            for query_id, query in queries
+        ]
+        latency[mode] = (time.perf_counter() - start) / max(len(queries), 1) * 1e3
+
+    def recall_at(k: int, ids: list[list]) -> float:
+        hits = [len(set(found[:k]) & set(exact[:k])) / k for found, exact in zip(ids, results['exact'])]
+        return sum(hits) / len(hits) if hits else float('nan')
+
+    recall = {
+        mode: {k: recall_at(k, ids) for k in k_values}
+        for mode, ids in results.items() if mode != 'exact'
+    }
+
+    return {
+        'points': n_points,
+        'vector_size': vector_size,
+        'quantization': type(info.config.quantization_config).__name__ if info.config.quantization_config else 'none',
+        'memory_mb': {
+            quantization: n_points * vector_size * size / 2 ** 20 for quantization, size in BYTES_PER_DIMENSION.items()
+        },
+        'recall': recall,
+        'latency_ms': latency,
+    }
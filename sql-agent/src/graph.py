@@ -2,6 +2,7 @@ import sys
 from pathlib import Path
 
 sys.path.append(str(Path(__file__).resolve().parents[1]))
+sys.path.append(str(Path(__file__).resolve().parents[2]))
 
 from typing import Annotated
 
@@ -14,15 +15,19 @@ from langchain_community.agent_toolkits import SQLDatabaseToolkit
 from langgraph.graph import StateGraph, END
 from langgraph.graph import MessagesState
 from langgraph.prebuilt import ToolNode
-from langgraph.checkpoint.memory import InMemorySaver
 
 from utils.helper_functions import postgres_connection_string
 from utils.config import ENV_FILE_PATH
 from src.prompts import check_query_system_prompt, generate_query_system_prompt
+from common.checkpointer import CheckpointManager
+from common.instrumentation import instrument_graph, instrument_node
 
 load_dotenv(ENV_FILE_PATH)
 
-memory = InMemorySaver()
+# conversation threads, persisted in checkpoints.sqlite unless CHECKPOINT_BACKEND says otherwise
+checkpoints = CheckpointManager(
+    default_sqlite_path=str(Path(__file__).resolve().parents[1] / 'checkpoints.sqlite')
+)
 langchain_db = SQLDatabase.from_uri(
     database_uri=postgres_connection_string('chinook')
 )
@@ -121,9 +126,9 @@ def should_continue(state: MessagesState) -> str:
 graph_builder = StateGraph(MessagesState)
 tools_node = ToolNode(tools=tools)
 
-graph_builder.add_node('generate_query', generate_query)
+graph_builder.add_node('generate_query', instrument_node(generate_query))
 graph_builder.set_entry_point('generate_query')
-graph_builder.add_node('tools', tools_node)
+graph_builder.add_node('tools', instrument_node(tools_node, 'tools'))
 graph_builder.add_conditional_edges(
     source='generate_query',
     path=should_continue,
@@ -134,7 +139,7 @@ graph_builder.add_conditional_edges(
 )
 graph_builder.add_edge('tools', 'generate_query')
 
-graph = graph_builder.compile(checkpointer=memory)
+graph = instrument_graph(graph_builder.compile(checkpointer=checkpoints.setup()))
 
     
 
@@ -154,5 +159,6 @@ def interact_with_agent(
         },
         config=config
     )
+    checkpoints.after_turn(session_id)
     
     return response['messages'][-1].content